@@ -0,0 +1,76 @@
+'''Measure the peak memory used to construct parsers as the output files grow
+
+The OUTCAR of the perov_relax_U example (or the pw.x output of TiO2.vcrelax) is grown by
+repeating everything after its parameter header, and each parser is constructed in a fresh
+interpreter so that the peak resident set size (RSS) of each run can be compared. With
+the output streamed through the parsers, the peak RSS should stay flat as the file grows.
+
+Usage: python benchmarks/outcar_memory.py [repeats ...]
+'''
+
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_measure = '''
+import resource, sys
+sys.path.insert(0, {root!r})
+from dfttopif.parsers import {parser}
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+{parser}.generate_from_directory({directory!r})
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(before, after)
+'''
+
+_cases = [
+    ('VaspParser', os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'), 'perov_relax_U', 'OUTCAR',
+     ' Dimension of arrays:'),
+    ('PwscfParser', os.path.join('examples', 'pwscf', 'TiO2.vcrelax.tar.gz'), 'TiO2.vcrelax', 'tio2.vcrelax.out',
+     '     Self-consistent Calculation'),
+]
+
+
+def grow_file(path, marker, repeats):
+    '''Repeat the body of an output file, which starts at the first line containing a marker'''
+    with open(path) as fp:
+        content = fp.read()
+    split = content.index(marker)
+    with open(path, 'w') as fp:
+        fp.write(content[:split])
+        for i in range(repeats):
+            fp.write(content[split:])
+
+
+def measure(parser, directory):
+    '''Get the peak RSS (kB) of constructing a parser, above that of importing it'''
+    script = _measure.format(root=_root, parser=parser, directory=directory)
+    before, after = map(int, subprocess.check_output([sys.executable, '-c', script]).split())
+    return after - before, after
+
+
+def main(repeats):
+    work_dir = tempfile.mkdtemp()
+    try:
+        print('{:>12} {:>8} {:>12} {:>16} {:>14}'.format('parser', 'repeats', 'size (MB)', 'parse RSS (MB)', 'peak RSS (MB)'))
+        for parser, archive, name, output, marker in _cases:
+            for n in repeats:
+                with tarfile.open(os.path.join(_root, archive)) as tp:
+                    tp.extractall(work_dir)
+                directory = os.path.join(work_dir, name)
+                grow_file(os.path.join(directory, output), marker, n)
+                size = os.path.getsize(os.path.join(directory, output)) / 1024.0 ** 2
+                delta, peak = measure(parser, directory)
+                print('{:>12} {:>8} {:>12.1f} {:>16.1f} {:>14.1f}'.format(parser, n, size, delta / 1024.0, peak / 1024.0))
+                shutil.rmtree(directory)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [1, 10, 100])
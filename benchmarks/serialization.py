@@ -0,0 +1,80 @@
+'''Compare the time to serialize pifs with pypif and with dfttopif's serializer
+
+Synthetic calculations (see synthetic.py) are converted once, and each pif is then written to JSON with
+    pif.dumps - pypif's encoder, as `pif.dump` writes pif.json
+    dumps_pif - dfttopif.serialization, compact
+The two documents are checked to hold the same data. The cases with large densities of states and many
+atoms are where the serializers differ most.
+
+Usage: python benchmarks/serialization.py [--cases NAME ...] [--repeats N]
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import warnings
+
+from synthetic import cases, _writers
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _root)
+
+from pypif import pif
+from dfttopif import files_to_pif
+from dfttopif.serialization import dumps_pif
+
+
+def measure(code, size, work_dir, repeats):
+    '''Convert a synthetic calculation, then time serializing its pif
+
+    Returns:
+        dict, with the time (s) of 'pif.dumps' and 'dumps_pif', and the 'size (MB)' of the compact document'''
+    writer, parser = _writers[code]
+    directory = tempfile.mkdtemp(dir=work_dir)
+    try:
+        writer(directory, **size)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            result = files_to_pif([os.path.join(directory, f) for f in os.listdir(directory)], quality_report=False)
+    finally:
+        shutil.rmtree(directory)
+
+    compact = dumps_pif(result)
+    if json.loads(compact.decode('ascii')) != json.loads(pif.dumps(result)):
+        raise AssertionError('The serializers disagree on {}'.format(code))
+    return {
+        'pif.dumps': min(timeit.repeat(lambda: pif.dumps(result), number=1, repeat=repeats)),
+        'dumps_pif': min(timeit.repeat(lambda: dumps_pif(result), number=1, repeat=repeats)),
+        'size (MB)': len(compact) / 1024.0 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pif serializers on synthetic calculations')
+    parser.add_argument('--cases', nargs='+', choices=sorted(cases),
+                        default=['vasp-small', 'vasp-atoms', 'vasp-dos', 'pwscf-atoms', 'pwscf-dos'],
+                        help='cases to run')
+    parser.add_argument('--repeats', type=int, default=5, help='number of times to serialize each pif')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        print('{:<14} {:>10} {:>14} {:>14} {:>9}'.format('case', 'size (MB)', 'pif.dumps (s)', 'dumps_pif (s)',
+                                                        'speedup'))
+        for name in args.cases:
+            code, size = cases[name]
+            result = measure(code, size, work_dir, args.repeats)
+            print('{:<14} {:>10.2f} {:>14.4f} {:>14.4f} {:>8.1f}x'.format(
+                name, result['size (MB)'], result['pif.dumps'], result['dumps_pif'],
+                result['pif.dumps'] / result['dumps_pif']))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
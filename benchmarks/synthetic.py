@@ -0,0 +1,392 @@
+'''Benchmark the parsers on synthetic calculations of configurable size
+
+Synthetic VASP (OUTCAR, DOSCAR, EIGENVAL, INCAR, POSCAR) and pw.x (input, output, DOS) files are
+generated with a chosen number of atoms, ionic steps, k-points and DOS points. Each case is then
+measured in a fresh interpreter:
+    parse - wall time to construct the parser
+    convert - wall time of `files_to_pif`, end to end, without the quality report
+    peak RSS - peak resident set size of the interpreter, after both
+
+The results are compared with a stored baseline (benchmarks/baseline.json by default), and cases
+that got slower or use more memory than the tolerance allows are flagged. Timings depend on the
+machine, so record a new baseline (--save-baseline) before comparing changes on another one.
+
+Usage: python benchmarks/synthetic.py [--scale X] [--cases NAME ...] [--baseline FILE] [--save-baseline]
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_root))
+
+# Size of each benchmark case. Each grows one dimension of the input from the 'small' calculation
+cases = {
+    'vasp-small': ('vasp', dict(atoms=8, steps=5, kpoints=20, dos_points=301)),
+    'vasp-steps': ('vasp', dict(atoms=8, steps=1000, kpoints=20, dos_points=301)),
+    'vasp-atoms': ('vasp', dict(atoms=1000, steps=5, kpoints=20, dos_points=301)),
+    'vasp-kpoints': ('vasp', dict(atoms=8, steps=5, kpoints=5000, dos_points=301)),
+    'vasp-dos': ('vasp', dict(atoms=16, steps=5, kpoints=20, dos_points=20000)),
+    'pwscf-small': ('pwscf', dict(atoms=8, steps=5, kpoints=20, dos_points=301)),
+    'pwscf-steps': ('pwscf', dict(atoms=8, steps=1000, kpoints=20, dos_points=301)),
+    'pwscf-atoms': ('pwscf', dict(atoms=1000, steps=5, kpoints=20, dos_points=301)),
+    'pwscf-kpoints': ('pwscf', dict(atoms=8, steps=5, kpoints=5000, dos_points=301)),
+    'pwscf-dos': ('pwscf', dict(atoms=8, steps=5, kpoints=20, dos_points=100000)),
+}
+
+# Elements of the synthetic structures, with one atom of the first per three atoms
+_species = ['Ti', 'O']
+
+# Electronic iterations per ionic step
+_electronic_steps = 5
+
+_measure = '''
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from dfttopif import files_to_pif
+from dfttopif.parsers import {parser}
+files = {files!r}
+start = time.time()
+{parser}(files)
+parse = time.time() - start
+start = time.time()
+files_to_pif(files, quality_report=False)
+convert = time.time() - start
+print(json.dumps({{'parse': parse, 'convert': convert,
+                  'peak RSS': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}}))
+'''
+
+
+def _structure(atoms):
+    '''Get the symbols, counts of each species, cell (Angstrom) and fractional positions of a synthetic crystal'''
+    counts = [max(1, atoms // 3)]
+    counts.append(atoms - counts[0])
+    symbols = [_species[0]] * counts[0] + [_species[1]] * counts[1]
+    # Place the atoms on a simple cubic grid
+    n = int(math.ceil(atoms ** (1.0 / 3)))
+    a = 2.0 * n
+    positions = [((i % n + 0.5) / n, (i // n % n + 0.5) / n, (i // n // n + 0.5) / n) for i in range(atoms)]
+    return symbols, counts, [[a, 0, 0], [0, a, 0], [0, 0, a]], positions
+
+
+def _energy(step, steps):
+    '''Total energy that decreases towards convergence during a relaxation'''
+    return -100.0 - 1.0 / (step + 1) + 1.0 / (steps + 1)
+
+
+def _band_energies(kpoint, nbands, nvalence):
+    '''Band energies with a 1 eV gap above the valence bands'''
+    return [-10.0 + 8.0 * b / nvalence + 0.01 * (kpoint % 7) + (1.0 if b >= nvalence else 0.0)
+            for b in range(nbands)]
+
+
+def write_vasp(directory, atoms=8, steps=5, kpoints=20, dos_points=301):
+    '''Write a synthetic VASP relaxation
+
+    Input:
+        directory - str, where to write the OUTCAR, DOSCAR, EIGENVAL, INCAR and POSCAR
+        atoms - int, number of atoms
+        steps - int, number of ionic steps
+        kpoints - int, number of irreducible k-points
+        dos_points - int, number of energies at which the DOS is given
+    '''
+    symbols, counts, cell, positions = _structure(atoms)
+    volume = cell[0][0] * cell[1][1] * cell[2][2]
+    nvalence = 2 * atoms
+    nbands = 2 * nvalence
+    efermi = -2.0 + 0.5
+
+    with open(os.path.join(directory, 'OUTCAR'), 'w') as fp:
+        fp.write(' vasp.5.4.4.18Apr17-6-g9f103f2a35 (build Jan 01 2020) complex\n \n')
+        for s in _species:
+            fp.write(' POTCAR:    PAW_PBE {} 08Apr2002\n'.format(s))
+        for s in _species:
+            fp.write(' POTCAR:    PAW_PBE {} 08Apr2002\n'.format(s))
+            fp.write('   VRHFIN ={}: synthetic\n   TITEL  = PAW_PBE {} 08Apr2002\n'.format(s, s))
+        fp.write('\n Found {:>6} irreducible k-points:\n \n Following reciprocal coordinates:\n'.format(kpoints))
+        fp.write('            Coordinates               Weight\n')
+        for k in range(kpoints):
+            fp.write('  {:.6f}  {:.6f}  {:.6f}      {:.6f}\n'.format(k / float(kpoints), 0, 0, 1.0))
+        fp.write(' \n Dimension of arrays:\n')
+        fp.write('   k-points           NKPTS = {:>6}   k-points in BZ     NKDIM = {:>6}   number of bands    '
+                 'NBANDS= {:>6}\n'.format(kpoints, kpoints, nbands))
+        fp.write('   number of dos      NEDOS = {:>6}   number of ions     NIONS = {:>6}\n'.format(dos_points, atoms))
+        fp.write('   ions per type =          {}\n'.format(''.join('{:>4}'.format(c) for c in counts)))
+        fp.write('   LSORBIT =      F    spin-orbit coupling\n')
+        fp.write('   ENCUT  =  400.0 eV  29.40 Ry    5.42 a.u.\n')
+        fp.write('   NELM   =     60;   NELMIN=  2; NELMDL= -5     # of ELM steps\n')
+        fp.write('   NSW    = {:>6}    number of steps for IOM\n'.format(steps))
+        fp.write('   ISIF   =      3    stress and relaxation\n')
+        fp.write('   GGA     =    --    GGA type\n')
+        fp.write('   NELECT = {:>12.4f}    total number of electrons\n\n'.format(2.0 * nvalence))
+
+        def write_cell():
+            fp.write('  volume of cell : {:>12.2f}\n'.format(volume))
+            fp.write('      direct lattice vectors                 reciprocal lattice vectors\n')
+            for v in cell:
+                fp.write('  {:>14.9f}{:>14.9f}{:>14.9f}  {:>14.9f}{:>14.9f}{:>14.9f}\n'.format(
+                    v[0], v[1], v[2], 1.0 / cell[0][0] if v[0] else 0, 1.0 / cell[1][1] if v[1] else 0,
+                    1.0 / cell[2][2] if v[2] else 0))
+            fp.write('\n')
+        write_cell()
+
+        for step in range(1, steps + 1):
+            energy = _energy(step, steps)
+            for e in range(1, _electronic_steps + 1):
+                fp.write('\n----------------------------------------- Iteration {:>4}({:>4})  '
+                         '---------------------------------------\n\n'.format(step, e))
+                fp.write(' number of electron {:>16.7f} magnetization {:>16.7f}\n'.format(2.0 * nvalence, 0.0))
+                fp.write('  free energy    TOTEN  = {:>18.8f} eV\n'.format(energy + 0.1 ** e))
+            fp.write('\n------------------------ aborting loop because EDIFF is reached '
+                     '----------------------------------------\n\n')
+            fp.write('  FORCE on cell =-STRESS in cart. coord.  units (eV):\n')
+            fp.write('  in kB {:>12.5f}{:>12.5f}{:>12.5f}{:>12.5f}{:>12.5f}{:>12.5f}\n'.format(
+                1.0 / step, 1.0 / step, 1.0 / step, 0, 0, 0))
+            fp.write('  external pressure = {:>12.2f} kB  Pullay stress =        0.00 kB\n\n'.format(1.0 / step))
+            fp.write(' VOLUME and BASIS-vectors are now :\n')
+            write_cell()
+            fp.write(' POSITION                                       TOTAL-FORCE (eV/Angst)\n')
+            fp.write(' ' + '-' * 83 + '\n')
+            for p in positions:
+                fp.write(' {:>12.5f}{:>13.5f}{:>13.5f}{:>17.6f}{:>14.6f}{:>14.6f}\n'.format(
+                    p[0] * cell[0][0], p[1] * cell[1][1], p[2] * cell[2][2], 0.01 / step, 0, 0))
+            fp.write(' ' + '-' * 83 + '\n\n')
+            fp.write('  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n')
+            fp.write('  ---------------------------------------------------\n')
+            fp.write('  free  energy   TOTEN  = {:>18.8f} eV\n\n'.format(energy))
+            fp.write('  energy  without entropy= {:>18.8f}  energy(sigma->0) = {:>18.8f}\n\n'.format(energy, energy))
+        fp.write(' reached required accuracy - stopping structural energy minimisation\n')
+        fp.write(' General timing and accounting informations for this job:\n')
+
+    with open(os.path.join(directory, 'EIGENVAL'), 'w') as fp:
+        fp.write(' {:>4} {:>4} {:>4} {:>4}\n'.format(atoms, atoms, steps, 1))
+        fp.write('  0.1000000E+02  0.2000000E-09  0.2000000E-09  0.2000000E-09  0.5000000E-15\n')
+        fp.write('  1.000000000000000E-004\n  CAR \n synthetic\n')
+        fp.write(' {:>5} {:>5} {:>5}\n'.format(2 * nvalence, kpoints, nbands))
+        for k in range(kpoints):
+            fp.write('\n  {:.7E}  {:.7E}  {:.7E}  {:.7E}\n'.format(k / float(kpoints), 0, 0, 1.0 / kpoints))
+            for b, e in enumerate(_band_energies(k, nbands, nvalence)):
+                fp.write('{:>4}{:>14.6f}\n'.format(b + 1, e))
+
+    with open(os.path.join(directory, 'DOSCAR'), 'w') as fp:
+        emin, emax = -12.0, 8.0
+        fp.write(' {:>4} {:>4} {:>4} {:>4}\n'.format(atoms, atoms, 1, 0))
+        fp.write('  0.1000000E+02  0.2000000E-09  0.2000000E-09  0.2000000E-09  0.5000000E-15\n')
+        fp.write('  1.000000000000000E-004\n  CAR \n synthetic\n')
+        header = '{:>15.8f}{:>15.8f} {:>5}{:>15.8f}{:>15.8f}\n'.format(emax, emin, dos_points, efermi, 1.0)
+        energies = [emin + (emax - emin) * i / (dos_points - 1) for i in range(dos_points)]
+        # States below -2 eV and above -1 eV, leaving a gap around the Fermi level
+        dos = [0.0 if -2.0 < e < -1.0 else 1.0 for e in energies]
+        fp.write(header)
+        total = 0.0
+        for e, d in zip(energies, dos):
+            total += d
+            fp.write('{:>10.3f}  {:.4E}  {:.4E}\n'.format(e, d, total))
+        for a in range(atoms):
+            fp.write(header)
+            for e, d in zip(energies, dos):
+                fp.write('{:>10.3f}'.format(e) + '  {:.4E}'.format(d / atoms) * 9 + '\n')
+
+    with open(os.path.join(directory, 'INCAR'), 'w') as fp:
+        fp.write('ENCUT = 400\nISIF = 3\nIBRION = 2\nNSW = {}\n'.format(steps))
+
+    with open(os.path.join(directory, 'POSCAR'), 'w') as fp:
+        fp.write('synthetic\n1.0\n')
+        for v in cell:
+            fp.write('  {:.9f}  {:.9f}  {:.9f}\n'.format(*v))
+        fp.write('  {}\n  {}\nDirect\n'.format(' '.join(_species), ' '.join(str(c) for c in counts)))
+        for p in positions:
+            fp.write('  {:.9f}  {:.9f}  {:.9f}\n'.format(*p))
+
+
+def write_pwscf(directory, atoms=8, steps=5, kpoints=20, dos_points=301):
+    '''Write a synthetic pw.x relaxation
+
+    Input:
+        directory - str, where to write the pw.in input, pw.out output and pw.dos DOS
+        atoms - int, number of atoms
+        steps - int, number of ionic steps
+        kpoints - int, number of irreducible k-points
+        dos_points - int, number of energies at which the DOS is given
+    '''
+    symbols, counts, cell, positions = _structure(atoms)
+    bohr = 0.529177249
+    alat = cell[0][0] / bohr
+    nvalence = 2 * atoms
+    nbands = 2 * nvalence
+
+    with open(os.path.join(directory, 'pw.in'), 'w') as fp:
+        fp.write("&control\n    calculation = 'relax'\n    prefix = 'synthetic'\n/\n")
+        fp.write('&system\n    ibrav = 1\n    celldm(1) = {}\n    nat = {}\n    ntyp = 2\n'
+                 '    ecutwfc = 50\n/\n'.format(alat, atoms))
+        fp.write('&electrons\n/\n&ions\n/\nATOMIC_SPECIES\n')
+        for s in _species:
+            fp.write(' {} 1.0 {}.UPF\n'.format(s, s))
+        fp.write('ATOMIC_POSITIONS crystal\n')
+        for s, p in zip(symbols, positions):
+            fp.write('{:<4} {:.9f} {:.9f} {:.9f}\n'.format(s, *p))
+        fp.write('K_POINTS automatic\n{} 1 1 0 0 0\n'.format(kpoints))
+
+    with open(os.path.join(directory, 'pw.out'), 'w') as fp:
+        fp.write('\n     Program PWSCF v.6.1 starts on  1Jan2020 at 10: 0: 0 \n\n')
+        fp.write('     bravais-lattice index     =            1\n')
+        fp.write('     lattice parameter (alat)  = {:>12.4f}  a.u.\n'.format(alat))
+        fp.write('     unit-cell volume          = {:>12.4f} (a.u.)^3\n'.format(alat ** 3))
+        fp.write('     number of atoms/cell      = {:>12}\n'.format(atoms))
+        fp.write('     number of atomic types    =            2\n')
+        fp.write('     number of electrons       = {:>12.2f}\n'.format(2.0 * nvalence))
+        fp.write('     number of Kohn-Sham states= {:>12}\n'.format(nbands))
+        fp.write('     kinetic-energy cutoff     =      50.0000  Ry\n')
+        fp.write('     Exchange-correlation      =  SLA  PZ   NOGX NOGC ( 1 1 0 0 0)\n')
+        fp.write('     nstep                     = {:>12}\n\n'.format(steps))
+        fp.write('     crystal axes: (cart. coord. in units of alat)\n')
+        for i in range(3):
+            fp.write('               a({}) = ( {:>10.6f} {:>10.6f} {:>10.6f} )  \n'.format(
+                i + 1, *[x / cell[0][0] for x in cell[i]]))
+        fp.write('\n')
+        for i, s in enumerate(_species):
+            fp.write('     PseudoPot. # {} for {:<2} read from file:\n     ./{}.UPF\n'.format(i + 1, s, s))
+            fp.write('     Pseudo is Norm-conserving, Zval =  4.0\n\n')
+        fp.write('   Cartesian axes\n\n     site n.     atom                  positions (alat units)\n')
+        for i, (s, p) in enumerate(zip(symbols, positions)):
+            fp.write('     {:>4}           {:<4}tau({:>4}) = ( {:>11.7f} {:>11.7f} {:>11.7f}  )\n'.format(
+                i + 1, s, i + 1, *p))
+        fp.write('\n     number of k points= {:>5}\n'.format(kpoints))
+        for k in range(kpoints):
+            fp.write('        k({:>5}) = ( {:>11.7f} {:>11.7f} {:>11.7f}), wk = {:>11.7f}\n'.format(
+                k + 1, k / float(kpoints), 0, 0, 2.0 / kpoints))
+
+        for step in range(1, steps + 1):
+            energy = _energy(step, steps) / 13.6057
+            fp.write('\n     Self-consistent Calculation\n')
+            for e in range(1, _electronic_steps + 1):
+                fp.write('\n     iteration #{:>3}     ecut=    50.00 Ry     beta=0.70\n'.format(e))
+                fp.write('     total energy              = {:>17.8f} Ry\n'.format(energy + 0.1 ** e))
+            fp.write('\n     End of self-consistent calculation\n')
+            for k in range(kpoints):
+                fp.write('\n          k ={:>7.4f}{:>7.4f}{:>7.4f} (  1000 PWs)   bands (ev):\n\n'.format(
+                    k / float(kpoints), 0, 0))
+                bands = _band_energies(k, nbands, nvalence)
+                for i in range(0, nbands, 8):
+                    fp.write('  ' + ''.join('{:>9.4f}'.format(x) for x in bands[i:i + 8]) + '\n')
+            fp.write('\n     the Fermi energy is {:>10.4f} ev\n\n'.format(-1.5))
+            fp.write('!    total energy              = {:>17.8f} Ry\n'.format(energy))
+            fp.write('     one-electron contribution = {:>17.8f} Ry\n'.format(energy / 2))
+            fp.write('     hartree contribution      = {:>17.8f} Ry\n'.format(-energy / 4))
+            fp.write('     xc contribution           = {:>17.8f} Ry\n'.format(energy / 8))
+            fp.write('     ewald contribution        = {:>17.8f} Ry\n\n'.format(energy * 5 / 8))
+            fp.write('     convergence has been achieved in {:>3} iterations\n\n'.format(_electronic_steps))
+            fp.write('     Forces acting on atoms (Ry/au):\n\n')
+            for i in range(atoms):
+                fp.write('     atom {:>4} type {:>2}   force = {:>14.8f}{:>14.8f}{:>14.8f}\n'.format(
+                    i + 1, 1 if symbols[i] == _species[0] else 2, 0.01 / step, 0, 0))
+            fp.write('\n     Total force = {:>12.6f}     Total SCF correction =     0.000000\n\n'.format(0.01 / step))
+            fp.write('          total   stress  (Ry/bohr**3)                   (kbar)     P= {:>8.2f}\n'.format(
+                1.0 / step))
+            for i in range(3):
+                row = [1.0 / step if i == j else 0.0 for j in range(3)]
+                fp.write('  ' + ''.join('{:>12.8f}'.format(x / 147105.08) for x in row) +
+                         '   ' + ''.join('{:>10.2f}'.format(x) for x in row) + '\n')
+            fp.write('\n     BFGS Geometry Optimization\n\n')
+            if step == steps:
+                fp.write('     bfgs converged in {:>3} scf cycles and {:>3} bfgs steps\n'.format(steps, steps - 1))
+                fp.write('     (criteria: energy < 0.10E-03, force < 0.10E-02, cell < 0.50E+00)\n\n')
+                fp.write('     End of BFGS Geometry Optimization\n\n')
+                fp.write('Begin final coordinates\n\n')
+            fp.write('ATOMIC_POSITIONS (crystal)\n')
+            for s, p in zip(symbols, positions):
+                fp.write('{:<4} {:>14.9f}{:>14.9f}{:>14.9f}\n'.format(s, *p))
+            if step == steps:
+                fp.write('End final coordinates\n')
+        fp.write('\n   JOB DONE.\n')
+
+    with open(os.path.join(directory, 'pw.dos'), 'w') as fp:
+        fp.write('#  E (eV)   dos(E)     Int dos(E)\n')
+        total = 0.0
+        for i in range(dos_points):
+            e = -12.0 + 20.0 * i / (dos_points - 1)
+            d = 0.0 if -2.0 < e < -1.0 else 1.0
+            total += d
+            fp.write('{:>7.3f}  {:.4E}  {:.4E}\n'.format(e, d, total))
+
+
+_writers = {'vasp': (write_vasp, 'VaspParser'), 'pwscf': (write_pwscf, 'PwscfParser')}
+
+
+def measure(code, size, work_dir):
+    '''Generate a synthetic calculation and time its conversion in a fresh interpreter
+
+    Returns:
+        dict, with the 'parse' and 'convert' times (s) and the 'peak RSS' (MB)'''
+    writer, parser = _writers[code]
+    directory = tempfile.mkdtemp(dir=work_dir)
+    try:
+        writer(directory, **size)
+        files = [os.path.join(directory, f) for f in sorted(os.listdir(directory))]
+        script = _measure.format(root=os.path.dirname(_root), parser=parser, files=files)
+        result = json.loads(subprocess.check_output([sys.executable, '-c', script]).decode('utf-8').splitlines()[-1])
+        result['size (MB)'] = sum(os.path.getsize(f) for f in files) / 1024.0 ** 2
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parsers on synthetic calculations')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the dimension each case grows (steps, atoms, k-points, DOS points)')
+    parser.add_argument('--cases', nargs='+', choices=sorted(cases), default=sorted(cases), help='cases to run')
+    parser.add_argument('--baseline', default=os.path.join(_root, 'baseline.json'), help='baseline results')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='flag cases that take more than this times the baseline time or memory')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    regressions = []
+    try:
+        print('{:<14} {:>10} {:>10} {:>12} {:>14}   {}'.format(
+            'case', 'size (MB)', 'parse (s)', 'convert (s)', 'peak RSS (MB)', 'vs. baseline'))
+        for name in args.cases:
+            code, size = cases[name]
+            small = cases['{}-small'.format(code)][1]
+            # Only scale the dimension this case is about
+            size = dict((k, int(v * args.scale) if v != small[k] else v) for k, v in size.items())
+            result = results[name] = measure(code, size, work_dir)
+
+            comparison = ''
+            if name in baseline and args.scale == 1.0:
+                # Times under 50 ms are mostly noise, so they are compared as if they took 50 ms
+                ratios = [max(result['convert'], 0.05) / max(baseline[name]['convert'], 0.05),
+                          result['peak RSS'] / baseline[name]['peak RSS']]
+                comparison = 'time x{:.2f}, memory x{:.2f}'.format(*ratios)
+                if max(ratios) > args.tolerance:
+                    comparison += '  REGRESSION'
+                    regressions.append(name)
+            print('{:<14} {:>10.1f} {:>10.3f} {:>12.3f} {:>14.1f}   {}'.format(
+                name, result['size (MB)'], result['parse'], result['convert'], result['peak RSS'], comparison))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fp:
+            json.dump(baseline, fp, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
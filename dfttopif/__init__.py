@@ -1,4 +1,11 @@
+__version__ = '1.1.0'
+
 from dfttopif.parsers import VaspParser
 from dfttopif.parsers import PwscfParser
 
 from .drivers import *
+from .cache import ConversionCache
+from .serialization import dump_pif, dumps_pif
+from .crawler import crawl
+from .tracing import Tracer, TimingCollector
+from .accounting import IOAccounting
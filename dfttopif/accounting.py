@@ -0,0 +1,151 @@
+import io
+import os
+import threading
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+class FileStats(object):
+    '''Reads of one file during an accounting session
+
+    Attributes:
+        opens - int, number of times the file was opened for reading
+        bytes_read - int, amount of data read (characters for files opened in text mode)
+        passes - int, number of times the file was read to its end
+    '''
+
+    def __init__(self):
+        self.opens = 0
+        self.bytes_read = 0
+        self.passes = 0
+
+    def __repr__(self):
+        return 'FileStats(opens={}, bytes_read={}, passes={})'.format(self.opens, self.bytes_read, self.passes)
+
+
+class _CountingFile(object):
+    '''Wrapper around an open file that reports what is read from it'''
+
+    def __init__(self, fp, stats, size):
+        self._fp = fp
+        self._stats = stats
+        self._size = size
+        self._read = 0
+        self._at_end = False
+
+    def _count(self, data, complete=False):
+        n = len(data)
+        self._read += n
+        self._stats.bytes_read += n
+        # The pass is over once the read came up short or has gone through the whole file
+        if complete or n == 0 or self._read >= self._size:
+            self._end()
+        return data
+
+    def _end(self):
+        if not self._at_end:
+            self._at_end = True
+            self._stats.passes += 1
+
+    def read(self, size=-1):
+        data = self._fp.read(size)
+        return self._count(data, size is None or size < 0 or len(data) < size)
+
+    def readline(self, *args):
+        return self._count(self._fp.readline(*args))
+
+    def readlines(self, *args):
+        lines = self._fp.readlines(*args)
+        self._count(''.join(lines) if lines and isinstance(lines[0], str) else b''.join(lines), not args)
+        return lines
+
+    def readinto(self, b):
+        n = self._fp.readinto(b)
+        self._count(b[:n], n < len(b))
+        return n
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            line = next(self._fp)
+        except StopIteration:
+            self._end()
+            raise
+        return self._count(line)
+
+    next = __next__
+
+    def seek(self, *args):
+        # Moving back allows another pass
+        self._at_end = False
+        self._read = 0
+        return self._fp.seek(*args)
+
+    def __enter__(self):
+        self._fp.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._fp.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class IOAccounting(object):
+    '''Count the reads of each file while converting a calculation
+
+    Use as a context manager. While it is active, every file opened for reading with `open` (or `io.open`)
+     is recorded, whichever module opens it:
+
+        with IOAccounting() as accounting:
+            directory_to_pif('/path/to/calculation/')
+        print(accounting.stats('/path/to/calculation/OUTCAR').passes)
+
+    Only one accounting session can be active at a time. Files that are memory-mapped count as
+     opened, but what is read from the map is not measured.
+    '''
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.files = {}
+
+    def stats(self, path):
+        '''Get the reads of a file
+
+        Input:
+            path - str, path to the file
+        Returns:
+            FileStats, which are all zero if the file was not read
+        '''
+        return self.files.get(os.path.abspath(path), FileStats())
+
+    def _wrap(self, original):
+        def counting_open(file, mode='r', *args, **kwargs):
+            fp = original(file, mode, *args, **kwargs)
+            if not isinstance(file, str) or any(x in mode for x in 'wax+'):
+                return fp
+            path = os.path.abspath(file)
+            stats = self.files.setdefault(path, FileStats())
+            stats.opens += 1
+            return _CountingFile(fp, stats, os.path.getsize(path))
+        return counting_open
+
+    def __enter__(self):
+        if not IOAccounting._lock.acquire(False):
+            raise RuntimeError('Another I/O accounting session is already active')
+        self._originals = builtins.open, io.open
+        builtins.open = self._wrap(self._originals[0])
+        io.open = self._wrap(self._originals[1])
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.open, io.open = self._originals
+        IOAccounting._lock.release()
+        return False
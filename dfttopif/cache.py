@@ -0,0 +1,113 @@
+import os
+import json
+import uuid
+import hashlib
+from pypif import pif
+from .serialization import dump_pif
+from . import __version__
+
+
+class ConversionCache(object):
+    '''Cache of converted pifs on local disk, keyed by the content of the converted files
+
+    Each entry is a JSON file named after the SHA-256 hash of the input files (names and contents),
+     the converter version and the conversion options. Reading an entry marks it as recently used,
+     and once the entries take more than `max_size` bytes the least recently used ones are removed.
+
+    To use it, pass an instance as the `cache` argument of `files_to_pif`, `directory_to_pif` or `tarfile_to_pif`.
+    '''
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        '''Open a cache, creating its directory if needed
+
+        Input:
+            directory - str, directory holding the cached pifs
+            max_size - int, maximum total size of the cached pifs, in bytes
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, files, **options):
+        '''Compute the cache key of a conversion
+
+        Input:
+            files - [str], files being converted. Only their base names and contents are used, so the same
+                files extracted to different temporary directories share a key
+            options - conversion options that change the output
+        Returns:
+            str, hex digest identifying the conversion
+        '''
+        # The converter version is part of the key, so that upgrades invalidate old results
+        digest = hashlib.sha256()
+        digest.update(__version__.encode('utf-8'))
+        digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        for f in sorted(filter(os.path.isfile, files), key=os.path.basename):
+            digest.update(os.path.basename(f).encode('utf-8') + b'\0')
+            with open(f, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1024 ** 2), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        '''Get a cached pif
+
+        Input:
+            key - str, cache key (see `key`)
+        Returns:
+            ChemicalSystem, or None if this conversion is not cached
+        '''
+        path = self._path(key)
+        try:
+            with open(path) as fp:
+                result = pif.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        '''Store a pif, evicting the least recently used entries if the cache is full
+
+        Input:
+            key - str, cache key (see `key`)
+            result - ChemicalSystem, pif to store
+        '''
+        # Write to a temporary file first, so that readers never see a partial entry
+        temp_path = os.path.join(self.directory, '.{}.tmp'.format(uuid.uuid4()))
+        with open(temp_path, 'wb') as fp:
+            dump_pif(result, fp)
+        os.rename(temp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache fits in `max_size`'''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(x[1] for x in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,237 @@
+import os
+import json
+import hashlib
+from dfttopif.drivers import batch_to_pif, _conversion_options
+from dfttopif.parsers import registered_parsers
+from dfttopif.serialization import dump_pif
+from . import __version__
+
+
+# Files written by the converter, which are not part of a calculation
+output_files = ('pif.json', 'quality_report.txt')
+
+# Default name of the manifest, kept in the root of the crawled tree
+manifest_name = '.dfttopif-manifest.jsonl'
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    '''Record of the calculations under a directory tree, and of the files each was last converted from
+
+    The manifest is a file of JSON lines, each holding the entry of one calculation directory:
+        {"directory": path relative to the root,
+         "files": {name: [size, mtime, sha256]},
+         "options": conversion options, "version": converter version,
+         "error": why the conversion failed, or null}
+    or {"directory": ..., "removed": true} once the calculation is gone. Later lines replace earlier ones.
+
+    Each entry is appended as soon as its calculation is converted, so an interrupted sweep loses at most the
+     conversions that were running, and the next sweep picks up where it stopped. `compact` rewrites the file
+     with one line per calculation.
+    '''
+
+    def __init__(self, path):
+        '''Open a manifest, reading its entries if the file exists
+
+        Input:
+            path - str, path to the manifest file
+        '''
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            complete = 0
+            with open(path, 'rb') as fp:
+                for line in fp:
+                    if not line.endswith(b'\n'):
+                        # The last line is incomplete if a sweep was killed while writing it
+                        break
+                    complete += len(line)
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if entry.get('removed'):
+                        self.entries.pop(entry['directory'], None)
+                    else:
+                        self.entries[entry['directory']] = entry
+
+            # Drop the incomplete line, so that the next entry is not appended to it
+            if complete < os.path.getsize(path):
+                with open(path, 'r+b') as fp:
+                    fp.truncate(complete)
+
+    def get(self, directory):
+        '''Get the entry of a calculation
+
+        Input:
+            directory - str, path of the calculation relative to the root
+        Returns:
+            dict, or None if the calculation is not in the manifest
+        '''
+        return self.entries.get(directory)
+
+    def _append(self, entry):
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def record(self, directory, files, options, error=None):
+        '''Record the conversion of a calculation
+
+        Input:
+            directory - str, path of the calculation relative to the root
+            files - dict, fingerprint of the converted files (see `fingerprint`)
+            options - str, conversion options
+            error - str, why the conversion failed, or None if it succeeded
+        '''
+        entry = {'directory': directory, 'files': files, 'options': options, 'version': __version__,
+                 'error': error}
+        self.entries[directory] = entry
+        self._append(entry)
+
+    def forget(self, directory):
+        '''Remove a calculation that no longer exists
+
+        Input:
+            directory - str, path of the calculation relative to the root
+        '''
+        if self.entries.pop(directory, None) is not None:
+            self._append({'directory': directory, 'removed': True})
+
+    def compact(self):
+        '''Rewrite the manifest with only the current entry of each calculation'''
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            for directory in sorted(self.entries):
+                fp.write(json.dumps(self.entries[directory], sort_keys=True) + '\n')
+        os.rename(temp_path, self.path)
+
+
+def fingerprint(directory, names, previous=None):
+    '''Describe the files of a calculation by their sizes, modification times and hashes
+
+    Files whose size and modification time match the previous fingerprint keep their previous hash without
+     being read again.
+
+    Input:
+        directory - str, calculation directory
+        names - [str], names of the files in the directory
+        previous - dict, earlier fingerprint of the same directory
+    Returns:
+        dict, [size, mtime, sha256] of each file, by name
+    '''
+    if previous is None:
+        previous = {}
+    result = {}
+    for name in names:
+        stat = os.stat(os.path.join(directory, name))
+        old = previous.get(name)
+        if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime:
+            result[name] = old
+        else:
+            result[name] = [stat.st_size, stat.st_mtime, _hash_file(os.path.join(directory, name))]
+    return result
+
+
+def _same_stats(names, directory, files):
+    '''Check whether the files of a directory have the sizes and modification times of a fingerprint'''
+    if sorted(names) != sorted(files):
+        return False
+    for name in names:
+        stat = os.stat(os.path.join(directory, name))
+        if files[name][0] != stat.st_size or files[name][1] != stat.st_mtime:
+            return False
+    return True
+
+
+def _same_contents(a, b):
+    '''Check whether two fingerprints describe files with the same names and contents'''
+    return sorted(a) == sorted(b) and all(a[name][2] == b[name][2] for name in a)
+
+
+def find_calculations(root, known=()):
+    '''Find the directories under a root that hold a DFT calculation
+
+    A directory is a calculation if one of the registered parsers recognizes its files, which only needs their
+     names and the first few KB of each (see `DFTParser.sniff`). The subdirectories of a calculation, such as the
+     scratch directories of pw.x, are not searched.
+
+    Input:
+        root - str, directory to search
+        known - collection of str, paths relative to the root of directories already known to be calculations,
+            whose files are not sniffed again
+    Returns:
+        generator of (directory, [file names]), for each calculation directory
+    '''
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        names = sorted(x for x in names if x not in output_files and not x.startswith(manifest_name))
+        if os.path.relpath(directory, root) in known or \
+                any(p.sniff([os.path.join(directory, x) for x in names]) for p in registered_parsers):
+            del subdirectories[:]
+            yield directory, names
+
+
+def crawl(root, manifest=None, workers=None, **kwargs):
+    '''Convert the calculations under a directory tree that are new or changed since the last crawl
+
+    Each calculation is written to pif.json in its directory. A calculation is converted again when any of its
+     files was added, removed or changed content, when its pif.json is missing, or when the converter or the
+     conversion options changed. Files whose size and modification time are unchanged are not read at all, so
+     a crawl of an unchanged tree only lists the directories and looks up the sizes and times of their files.
+
+    Input:
+        root - str, directory to crawl
+        manifest - str, path to the manifest of the previous crawls (see `Manifest`).
+            Defaults to .dfttopif-manifest.jsonl in the root
+        workers - int, number of worker processes for the conversions (see `batch_to_pif`)
+        kwargs - any additional keyword arguments. (See `files_to_pif`)
+    Returns:
+        generator of (directory, status, error) tuples, where status is one of 'unchanged', 'converted',
+            'failed' or 'removed', and error describes a failed conversion
+    '''
+    manifest = Manifest(manifest if manifest is not None else os.path.join(root, manifest_name))
+    options = json.dumps(_conversion_options(**kwargs), sort_keys=True)
+
+    # Find what needs converting
+    found = set()
+    pending = {}
+    for directory, names in find_calculations(root, manifest.entries):
+        key = os.path.relpath(directory, root)
+        found.add(key)
+        entry = manifest.get(key)
+        current = entry is not None and entry['options'] == options and entry['version'] == __version__ and \
+            (entry['error'] is not None or os.path.isfile(os.path.join(directory, 'pif.json')))
+        if current and _same_stats(names, directory, entry['files']):
+            yield directory, 'unchanged' if entry['error'] is None else 'failed', entry['error']
+            continue
+
+        files = fingerprint(directory, names, entry['files'] if entry is not None else None)
+        if current and _same_contents(files, entry['files']):
+            # Only the modification times changed. Note the new ones to avoid hashing the files again
+            manifest.record(key, files, options, entry['error'])
+            yield directory, 'unchanged' if entry['error'] is None else 'failed', entry['error']
+            continue
+        pending[directory] = (key, files)
+
+    # Convert them, noting each one in the manifest as soon as it is done
+    conversions = batch_to_pif(sorted(pending), workers=workers, ordered=False, **kwargs) if pending else []
+    for directory, pif_contents, error in conversions:
+        key, files = pending[directory]
+        if error is None:
+            with open(os.path.join(directory, 'pif.json'), 'wb') as fp:
+                dump_pif(pif_contents, fp)
+        manifest.record(key, files, options, error)
+        yield directory, 'converted' if error is None else 'failed', error
+
+    # Forget the calculations that are gone
+    for key in sorted(set(manifest.entries) - found):
+        manifest.forget(key)
+        yield os.path.join(root, key), 'removed', None
+    manifest.compact()
@@ -1,41 +1,135 @@
+import io
 import os
 import uuid
 import tarfile
 import shutil
+import functools
+import threading
+import multiprocessing
 from dfttopif.parsers import VaspParser
 from dfttopif.parsers import PwscfParser
-from dfttopif.parsers.base import InvalidIngesterException
+from dfttopif.parsers import registered_parsers
+from dfttopif.parsers.base import InvalidIngesterException, header_size
+from dfttopif.parsers.vasp import compact_outcar
+from dfttopif.tracing import null_tracer
 from pypif.obj import *
 import json
 
 
-def _add_quality_report(parser, pif, inline=True):
-    import tarfile
+# Service that scores VASP calculations for the quality report
+quality_report_url = os.environ.get('DFTTOPIF_QUALITY_REPORT_URL', 'https://calval.citrination.com/validate')
 
-    # if the parser lacks an INCAR, return None
-    if parser.incar is None:
-        return None
+# Timeouts (connect, read) in seconds for quality report requests
+quality_report_timeout = (10, 300)
+
+# Number of quality reports that may be in flight at once
+quality_report_workers = 4
+
+# Whether to send only the parts of the OUTCAR the quality checks use, rather than the whole file
+quality_report_compact_outcar = True
+
+# Session and thread pool for submitting quality reports, created on first use in each process
+_quality_report_state = {}
+_quality_report_lock = threading.Lock()
+
+
+def _get_quality_report_state():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from multiprocessing.pool import ThreadPool
 
-    # Create the tar file
-    tar = tarfile.open("tmp.tar", "w")
-    tar.add(parser.outcar, arcname="OUTCAR")
+    # Neither the pool threads nor the open connections survive a fork, so each process gets its own. Conversions
+    #  running on several threads (e.g. in the web service) must not each create one
+    with _quality_report_lock:
+        if _quality_report_state.get('pid') != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=quality_report_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _quality_report_state.update(pid=os.getpid(), session=session, pool=ThreadPool(quality_report_workers))
+    return _quality_report_state
+
+
+def _make_quality_report_tar(parser, compact=None):
+    '''Build the tar file sent to the quality report service, in memory
+
+    Input:
+        parser - VaspParser, calculation to report on
+        compact - bool, whether to send a reduced OUTCAR (see `compact_outcar`).
+            Defaults to `quality_report_compact_outcar`
+    Returns:
+        bytes, tar file holding the OUTCAR and INCAR'''
+    if compact is None:
+        compact = quality_report_compact_outcar
+
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode="w")
+    if compact:
+        outcar = compact_outcar(parser.outcar)
+        info = tarfile.TarInfo("OUTCAR")
+        info.size = len(outcar)
+        info.mtime = os.path.getmtime(parser.outcar)
+        tar.addfile(info, io.BytesIO(outcar))
+    else:
+        tar.add(parser.outcar, arcname="OUTCAR")
     tar.add(parser.incar, arcname="INCAR")
     tar.close()
+    return buf.getvalue()
 
+
+def _request_quality_report(parser, inline):
+    '''Upload a calculation to the quality report service
+
+    Returns:
+        (report, score), or None if the report could not be generated'''
     import requests
+
+    session = _get_quality_report_state()['session']
+    url = quality_report_url + ('/json/tarfile' if inline else '/tarfile')
+    try:
+        r = session.post(url, data=_make_quality_report_tar(parser), timeout=quality_report_timeout)
+    except requests.RequestException as e:
+        print("Unable to generate quality report; request failed with {}".format(e))
+        return None
+
+    if r.status_code != requests.codes.ok:
+        print("Unable to generate quality report; request returned with status {}".format(r.status_code))
+        return None
+
     if inline:
-        r = requests.post('https://calval.citrination.com/validate/json/tarfile', data=open('tmp.tar', 'rb').read())
         report = json.loads(r.json()[0])
         score = report["score"]
     else:
-        r = requests.post('https://calval.citrination.com/validate/tarfile', data=open('tmp.tar', 'rb').read())
         report = r.json()[0]
         score = int(report.split('\n')[0].split()[-1]) # the score is the last token on the first line
-    os.remove("tmp.tar")
+    return report, score
 
-    if r.status_code != requests.codes.ok:
-        print("Unable to generate quality report; request returned with status {}".format(r.status_code))
+
+def _submit_quality_report(parser, inline=True):
+    '''Start generating a quality report in the background
+
+    Input:
+        parser - VaspParser, calculation to report on
+        inline - bool, whether the report will be stored in the pif rather than in a file
+    Returns:
+        AsyncResult to pass to `_add_quality_report`, or None if the parser lacks an INCAR'''
+    if parser.incar is None:
+        return None
+    return _get_quality_report_state()['pool'].apply_async(_request_quality_report, (parser, inline))
+
+
+def _add_quality_report(parser, pif, inline=True, pending=None):
+    # if the parser lacks an INCAR, return None
+    if parser.incar is None:
+        return None
+
+    # Wait for the report, requesting it now if it was not submitted earlier
+    if pending is None:
+        pending = _submit_quality_report(parser, inline)
+    result = pending.get()
+    if result is None:
         return
+    report, score = result
 
     if inline:
         setattr(pif, "quality_report", report)
@@ -56,7 +150,37 @@ def _add_quality_report(parser, pif, inline=True):
     return pif
 
 
-def tarfile_to_pif(filename, temp_root_dir='', verbose=0):
+def _extract_wanted_members(tar, path):
+    """
+    Extract the members of a tar stream that a registered parser may read, skipping the rest without writing them.
+
+    Input:
+        tar - TarFile, archive opened for reading (streaming mode is fine, as members are visited in order)
+        path - String, Directory in which to extract the files
+    """
+    for member in tar:
+        if not member.isfile():
+            continue
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name.startswith(os.pardir):
+            continue
+
+        # Decide from the name and the beginning of the contents
+        fp = tar.extractfile(member)
+        header = fp.read(header_size)
+        if not any(p.wants_file(name, header.decode('utf-8', 'replace')) for p in registered_parsers):
+            continue
+
+        target = os.path.join(path, name)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        with open(target, 'wb') as output:
+            output.write(header)
+            shutil.copyfileobj(fp, output)
+
+
+def tarfile_to_pif(filename, temp_root_dir='', verbose=0, selective=False, cache=None, tracer=null_tracer,
+                   **kwargs):
     """
     Process a tar file that contains DFT data.
 
@@ -64,6 +188,65 @@ def tarfile_to_pif(filename, temp_root_dir='', verbose=0):
         filename - String, Path to the file to process.
         temp_root_dir - String, Directory in which to save temporary files. Defaults to working directory.
         verbose - int, How much status messages to print
+        selective - bool, Whether to stream through the archive and only extract the files that the parsers read
+        cache - ConversionCache, Cache of previous conversions, keyed by the content of the archive
+        tracer - Tracer, receives the time spent in each step of the conversion (see `dfttopif.tracing`)
+        kwargs - any additional keyword arguments. (See `files_to_pif`)
+
+    Output:
+        pif - ChemicalSystem, Results and settings of
+            the DFT calculation in pif format
+    """
+    if cache is not None:
+        key = cache.key([filename], **_conversion_options(**kwargs))
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    tar = tarfile.open(filename, 'r|*' if selective else 'r')
+    try:
+        result = _tar_to_pif(tar, temp_root_dir, selective, verbose=verbose, tracer=tracer, **kwargs)
+    finally:
+        tar.close()
+
+    if cache is not None:
+        with tracer.span('serialization', 'cache'):
+            cache.put(key, result)
+    return result
+
+
+def tarstream_to_pif(fileobj, temp_root_dir='', verbose=0, **kwargs):
+    """
+    Process a tar file that contains DFT data as it is being read, such as while it is downloaded.
+
+    Only the files that the parsers read are extracted (See `tarfile_to_pif`).
+
+    Input:
+        fileobj - file-like object, Stream holding the (optionally compressed) tar file.
+        temp_root_dir - String, Directory in which to save temporary files. Defaults to working directory.
+        verbose - int, How much status messages to print
+        kwargs - any additional keyword arguments. (See `files_to_pif`)
+
+    Output:
+        pif - ChemicalSystem, Results and settings of
+            the DFT calculation in pif format
+    """
+    tar = tarfile.open(fileobj=fileobj, mode='r|*')
+    try:
+        return _tar_to_pif(tar, temp_root_dir, True, verbose=verbose, **kwargs)
+    finally:
+        tar.close()
+
+
+def _tar_to_pif(tar, temp_root_dir, selective, **kwargs):
+    """
+    Extract an open tar file to a temporary directory and convert it
+
+    Input:
+        tar - TarFile, Archive to convert.
+        temp_root_dir - String, Directory in which to save temporary files.
+        selective - bool, Whether to only extract the files that the parsers read
+        kwargs - any additional keyword arguments. (See `directory_to_pif`)
 
     Output:
         pif - ChemicalSystem, Results and settings of
@@ -72,36 +255,123 @@ def tarfile_to_pif(filename, temp_root_dir='', verbose=0):
     temp_dir = temp_root_dir + str(uuid.uuid4())
     os.makedirs(temp_dir)
     try:
-        tar = tarfile.open(filename, 'r')
-        tar.extractall(path=temp_dir)
-        tar.close()
+        with kwargs.get('tracer', null_tracer).span('extract'):
+            if selective:
+                _extract_wanted_members(tar, temp_dir)
+            else:
+                tar.extractall(path=temp_dir)
         for i in os.listdir(temp_dir):
             cur_dir = temp_dir + '/' + i
             if os.path.isdir(cur_dir):
-                return directory_to_pif(cur_dir, verbose=verbose)
-        return directory_to_pif(temp_dir, verbose=verbose)
+                return directory_to_pif(cur_dir, **kwargs)
+        return directory_to_pif(temp_dir, **kwargs)
     finally:
         shutil.rmtree(temp_dir)
 
 
-def archive_to_pif(filename, verbose=0):
+def archive_to_pif(filename, verbose=0, **kwargs):
     """
     Given a archive file that contains output from a DFT calculation, parse the data and return a PIF object.
 
     Input:
         filename - String, Path to the file to process.
         verbose - int, How much status messages to print
+        kwargs - any additional keyword arguments. (See `tarfile_to_pif`)
 
     Output:
         pif - ChemicalSystem, Results and settings of
             the DFT calculation in pif format
     """
     if tarfile.is_tarfile(filename):
-        return tarfile_to_pif(filename, verbose)
+        return tarfile_to_pif(filename, verbose=verbose, **kwargs)
     raise Exception('Cannot process file type')
 
 
-def files_to_pif(files, verbose=0, quality_report=True, inline=True):
+def detect_parser(files, tracer=null_tracer):
+    '''Create a parser for a list of files from a DFT calculation
+
+    Each registered parser first sniffs the file names and headers, and only the
+    parsers that recognize the files are constructed.
+
+    Input:
+        files - [str] list of files from which the parser is allowed to read.
+        tracer - Tracer, receives the time spent sniffing and constructing each parser
+
+    Output:
+        parser - DFTParser, parser for these files
+    '''
+    for possible_parser in registered_parsers:
+        with tracer.span('detect', possible_parser.__name__):
+            if not possible_parser.sniff(files):
+                continue
+        try:
+            with tracer.span('construct', possible_parser.__name__):
+                return possible_parser(files)
+        except InvalidIngesterException:
+            # Constructors fail when they cannot find appropriate files
+            pass
+    raise Exception('Directory is not in correct format for an existing parser')
+
+
+def _conversion_options(quality_report=True, inline=True, include=None, exclude=None, trajectory=None, **kwargs):
+    '''Get the options of a conversion that change its pif, in a canonical form
+
+    Conversions that give the same pif get the same options, whatever order the names of the settings and
+     properties are listed in and whether defaults are passed explicitly. Options that only change how the
+     conversion runs, such as `threads` or `tracer`, are left out.
+
+    Input:
+        any keyword arguments of `files_to_pif`
+    Returns:
+        dict, options to key the cache and the crawl manifests with
+    '''
+    options = dict(quality_report=quality_report, inline=inline,
+                   include=sorted(set(include)) if include is not None else None,
+                   exclude=sorted(set(exclude)) if exclude is not None else None)
+    if trajectory is not None:
+        # Only listed when set, so that conversions made before this option existed keep their keys
+        options['trajectory'] = trajectory
+    return options
+
+
+def _is_wanted(name, include, exclude):
+    '''Check whether a setting or property was requested'''
+    if include is not None and name not in include:
+        return False
+    return exclude is None or name not in exclude
+
+
+def _call_getters(parser, getters, tracer, threads=None):
+    '''Call getters of a parser, optionally on a pool of threads
+
+    Input:
+        parser - DFTParser, parser to call
+        getters - [(kind, name, function)], getters to call, where kind is 'setting' or 'property', and function
+            is the name of a method of the parser or a callable
+        tracer - Tracer, receives the time spent in each getter
+        threads - int, number of getters to run at once. By default, they are called one after the other
+    Returns:
+        [(name, result)], in the same order as `getters`
+    '''
+    def call(kind, name, func):
+        with tracer.span(kind, name):
+            return func() if callable(func) else getattr(parser, func)()
+
+    if not threads or threads < 2 or len(getters) < 2:
+        return [(name, call(kind, name, func)) for kind, name, func in getters]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(threads, len(getters)))
+    try:
+        pending = [(name, pool.apply_async(call, (kind, name, func))) for kind, name, func in getters]
+        return [(name, result.get()) for name, result in pending]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def files_to_pif(files, verbose=0, quality_report=True, inline=True, cache=None, tracer=null_tracer,
+                 include=None, exclude=None, threads=None, trajectory=None):
     '''Given a directory that contains output from
     a DFT calculation, parse the data and return
     a pif object
@@ -109,91 +379,118 @@ def files_to_pif(files, verbose=0, quality_report=True, inline=True):
     Input:
         files - [str] list of files from which the parser is allowed to read.
         verbose - int, How much status messages to print
+        cache - ConversionCache, Cache of previous conversions, keyed by the content of the files
+        tracer - Tracer, receives the time spent in each step of the conversion (see `dfttopif.tracing`)
+        include - [str], names of the only settings and properties to extract (e.g. 'Total Energy').
+            By default, all of them are extracted
+        exclude - [str], names of settings and properties not to extract
+        threads - int, number of getters to run at once on a pool of threads, so that reading different files
+            overlaps (e.g. the DOSCAR and EIGENVAL of a VASP calculation). By default, getters run one at a time.
+            Either way, the properties are listed in the same order
+        trajectory - int, stride between the ionic steps listed in a 'Trajectory' property (see
+            `DFTParser.get_trajectory`). By default, only the final ionic step is described
 
     Output:
         pif - ChemicalSystem, Results and settings of
             the DFT calculation in pif format
     '''
+    if include is not None:
+        include = sorted(set(include))
+    if exclude is not None:
+        exclude = sorted(set(exclude))
+
+    # Check whether these files were already converted
+    if cache is not None:
+        key = cache.key(files, **_conversion_options(quality_report=quality_report, inline=inline, include=include,
+                                                     exclude=exclude, trajectory=trajectory))
+        chem = cache.get(key)
+        if chem is not None:
+            return chem
 
     # Look for the first parser compatible with the directory
-    found_parser = False
-    for possible_parser in [PwscfParser, VaspParser]:
-        try:
-            parser = possible_parser(files)
-            found_parser = True
-            break
-        except InvalidIngesterException:
-            # Constructors fail when they cannot find appropriate files
-            pass
-    if not found_parser:
-        raise Exception('Directory is not in correct format for an existing parser')
+    parser = detect_parser(files, tracer)
     if verbose > 0:
         print("Found a {} directory".format(parser.get_name()))
-        
-    # Get information about the chemical system
-    chem = ChemicalSystem()
-    chem.chemical_formula = parser.get_composition()
-        
-    # Get software information, to list as method
-    software = Software(name=parser.get_name(),
-        version=parser.get_version_number())
-        
-    # Define the DFT method object
-    method = Method(name='Density Functional Theory',
-        software=[software])
-        
-    # Get the settings (aka. "conditions") of the DFT calculations
-    conditions = []
-    for name, func in parser.get_setting_functions().items():
-        # Get the condition
-        cond = getattr(parser, func)()
-
-        # If the condition is None or False, skip it
-        if cond is None:
-            continue
-
-        if inline and cond.files is not None:
-            continue
-
-        # Set the name
-        cond.name = name
-
-        # Set the types
-        conditions.append(cond)
-    
-    # Get the properties of the system
-    chem.properties = []
-    for name, func in parser.get_result_functions().items():
-        # Get the property
-        prop = getattr(parser, func)()
-        
-        # If the property is None, skip it
-        if prop is None:
-            continue
-
-        if inline and prop.files is not None:
-            continue
-
-        # Add name and other data
-        prop.name = name
-        prop.methods = [method,]
-        prop.data_type='COMPUTATIONAL'
-        if verbose > 0 and isinstance(prop, Value):
-            print(name)
-        if prop.conditions is None:
-            prop.conditions = conditions
-        else:
-            if not isinstance(prop.conditions, list):
-                prop.conditions = [prop.conditions]
-            prop.conditions.extend(conditions)
 
-        # Add it to the output
-        chem.properties.append(prop)
-
-    # Check to see if we should add the quality report
+    # Upload the calculation for its quality report while the pif is assembled
     if quality_report and isinstance(parser, VaspParser):
-        _add_quality_report(parser, chem)
-
+        pending_report = _submit_quality_report(parser)
+
+    with tracer.span('assembly'):
+        # Get information about the chemical system
+        chem = ChemicalSystem()
+        with tracer.span('metadata', 'chemical formula'):
+            chem.chemical_formula = parser.get_composition()
+
+        # Get software information, to list as method
+        with tracer.span('metadata', 'software'):
+            software = Software(name=parser.get_name(),
+                version=parser.get_version_number())
+
+        # Define the DFT method object
+        method = Method(name='Density Functional Theory',
+            software=[software])
+
+        # Call the getters for the requested settings (aka. "conditions") and properties, skipping the rest
+        settings = [(name, func) for name, func in parser.get_setting_functions().items()
+                    if _is_wanted(name, include, exclude)]
+        results = [(name, func) for name, func in parser.get_result_functions().items()
+                   if _is_wanted(name, include, exclude)]
+        if trajectory is not None and _is_wanted('Trajectory', include, exclude):
+            results.append(('Trajectory', functools.partial(parser.get_trajectory, trajectory)))
+        values = _call_getters(parser, [('setting', name, func) for name, func in settings] +
+                               [('property', name, func) for name, func in results], tracer, threads)
+
+        # Get the settings of the DFT calculations
+        conditions = []
+        for name, cond in values[:len(settings)]:
+            # If the condition is None or False, skip it
+            if cond is None:
+                continue
+
+            if inline and cond.files is not None:
+                continue
+
+            # Set the name
+            cond.name = name
+
+            # Set the types
+            conditions.append(cond)
+
+        # Get the properties of the system
+        chem.properties = []
+        for name, prop in values[len(settings):]:
+            # If the property is None, skip it
+            if prop is None:
+                continue
+
+            if inline and prop.files is not None:
+                continue
+
+            # Add name and other data
+            prop.name = name
+            prop.methods = [method,]
+            prop.data_type='COMPUTATIONAL'
+            if verbose > 0 and isinstance(prop, Value):
+                print(name)
+            if prop.conditions is None:
+                prop.conditions = conditions
+            else:
+                if not isinstance(prop.conditions, list):
+                    prop.conditions = [prop.conditions]
+                prop.conditions.extend(conditions)
+
+            # Add it to the output
+            chem.properties.append(prop)
+
+        # Check to see if we should add the quality report
+        if quality_report and isinstance(parser, VaspParser):
+            with tracer.span('quality report'):
+                _add_quality_report(parser, chem, pending=pending_report)
+
+    if cache is not None:
+        with tracer.span('serialization', 'cache'):
+            cache.put(key, chem)
     return chem
 
 
@@ -217,7 +514,7 @@ def convert(files, **kwargs):
     """
     Wrap directory to pif as a dice extension
     :param files: a list of files, which must be non-empty
-    :param kwargs: any additional keyword arguments
+    :param kwargs: any additional keyword arguments. (See `files_to_pif`)
     :return: the created pif
     """
 
@@ -231,3 +528,45 @@ def convert(files, **kwargs):
             return directory_to_pif(files[0], **kwargs)
     else:
         return files_to_pif([x for x in files if os.path.isfile(x)], **kwargs)
+
+
+def _convert_one(kwargs, path):
+    """
+    Convert a single calculation for `batch_to_pif`, capturing any error
+    :param kwargs: keyword arguments for the conversion
+    :param path: directory or archive holding the calculation
+    :return: tuple of (path, pif, error), where error is None on success
+    """
+    try:
+        if os.path.isdir(path):
+            return path, directory_to_pif(path, **kwargs), None
+        return path, archive_to_pif(path, **kwargs), None
+    except Exception as e:
+        return path, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def batch_to_pif(paths, workers=None, ordered=True, **kwargs):
+    """
+    Convert many calculations, spreading them over a pool of processes
+    :param paths: list of directories or archives, each holding one calculation
+    :param workers: number of worker processes. Defaults to the number of CPUs
+    :param ordered: whether to yield results in the order of `paths`, or as they complete
+    :param kwargs: any additional keyword arguments. (See `files_to_pif`)
+    :return: generator of (path, pif, error) tuples. If a calculation fails, its pif is None and
+        error describes the failure; the rest of the batch carries on
+    """
+    convert_one = functools.partial(_convert_one, kwargs)
+    if workers == 1:
+        for path in paths:
+            yield convert_one(path)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.imap(convert_one, paths) if ordered else pool.imap_unordered(convert_one, paths)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
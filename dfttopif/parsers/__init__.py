@@ -2,3 +2,6 @@
 
 from .vasp import VaspParser
 from .pwscf import PwscfParser
+
+registered_parsers = [PwscfParser, VaspParser]
+'''Parsers tried when converting a calculation, in order of precedence'''
@@ -0,0 +1,82 @@
+import numpy as np
+from pypif.obj import Property, Scalar, Value
+
+
+def _wrap(data):
+    '''Convert nested lists of numbers into nested lists of Scalar objects'''
+    if isinstance(data, list):
+        return [_wrap(x) for x in data]
+    return Scalar(value=data)
+
+
+def _as_dictionaries(data):
+    '''Convert nested lists of numbers into the pif form of nested lists of Scalar objects'''
+    if isinstance(data, list):
+        return [_as_dictionaries(x) for x in data]
+    return {'value': data}
+
+
+class _ArrayFields(object):
+    '''Lets the scalars, vectors and matrices of a Value or Property be NumPy arrays
+
+    An array is stored as is, rather than as one Scalar object per number, and is only converted when the object
+     is serialized. Reading a field that holds an array still gives nested lists of Scalar objects, built on each
+     access, so code written for the plain pypif objects keeps working. Use `array` to get the array itself.
+
+    Fields set to anything other than an array behave exactly as in pypif.
+    '''
+
+    _dimensions = {'scalars': 1, 'vectors': 2, 'matrices': 3}
+
+    def array(self, field):
+        '''Get the array held by a field
+
+        Input:
+            field - str, 'scalars', 'vectors' or 'matrices'
+        Returns:
+            ndarray, or None if the field does not hold an array
+        '''
+        data = getattr(self, '_' + field)
+        return data if isinstance(data, np.ndarray) else None
+
+    def _get_field(self, field):
+        data = getattr(self, '_' + field)
+        if isinstance(data, np.ndarray):
+            return _wrap(data.tolist())
+        return data
+
+    def _set_field(self, field, data):
+        if isinstance(data, np.ndarray):
+            if data.ndim != self._dimensions[field]:
+                raise ValueError('{}.{} must be a {}D array, not {}D'.format(
+                    self.__class__.__name__, field, self._dimensions[field], data.ndim))
+            setattr(self, '_' + field, data)
+        else:
+            getattr(Value, field).fset(self, data)
+
+    scalars = property(lambda self: self._get_field('scalars'),
+                       lambda self, data: self._set_field('scalars', data))
+
+    vectors = property(lambda self: self._get_field('vectors'),
+                       lambda self, data: self._set_field('vectors', data))
+
+    matrices = property(lambda self: self._get_field('matrices'),
+                        lambda self, data: self._set_field('matrices', data))
+
+    def as_dictionary(self):
+        result = super(_ArrayFields, self).as_dictionary()
+        for field in self._dimensions:
+            data = self.array(field)
+            if data is not None:
+                result[field] = _as_dictionaries(data.tolist())
+        return result
+
+
+class ArrayValue(_ArrayFields, Value):
+    '''Value whose scalars, vectors or matrices may be held in NumPy arrays (see `_ArrayFields`)'''
+    pass
+
+
+class ArrayProperty(_ArrayFields, Property):
+    '''Property whose scalars, vectors or matrices may be held in NumPy arrays (see `_ArrayFields`)'''
+    pass
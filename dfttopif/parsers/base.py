@@ -1,6 +1,8 @@
 import os
+import numpy as np
 from collections import Counter
 from pypif.obj.common import Value, Property, Scalar
+from .arrays import ArrayProperty, ArrayValue
 
 
 def Value_if_true(func):
@@ -13,6 +15,25 @@ class InvalidIngesterException(ValueError):
     pass
 
 
+header_size = 4096
+''' Number of bytes read from the beginning of a file to decide what it holds '''
+
+
+def read_header(path, size=header_size):
+    '''Read the beginning of a file, for cheaply deciding what kind of file it is
+
+    Input:
+        path - str, path to the file
+        size - int, maximum number of bytes to read
+    Returns:
+        str, decoded header of the file, or '' if it cannot be read'''
+    try:
+        with open(path, 'rb') as fp:
+            return fp.read(size).decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return ''
+
+
 class DFTParser(object):
     '''Base class for all tools to parse a directory of output files from a DFT Calculation
     
@@ -42,6 +63,9 @@ class DFTParser(object):
     
     _converged = None
     ''' Whether this calculation has converged '''
+
+    _output_structure = None
+    ''' Output structure of this calculation '''
     
     def __init__(self, files):
         '''Initialize a parser by defining the list of files that the parser can read from.
@@ -53,6 +77,34 @@ class DFTParser(object):
         '''
         self._files = files
 
+    @classmethod
+    def sniff(cls, files):
+        '''Cheaply decide whether a list of files could be parsed by this parser
+
+        Implementations should only look at file names and the first few KB of each file (see `read_header`), so that
+         detecting the DFT code does not require reading any file in full. The constructor still has the final say.
+
+        Input:
+            files - [str], list of files usable by this parser.
+        Returns:
+            bool, whether it is worth constructing this parser
+        '''
+        raise NotImplementedError
+
+    @classmethod
+    def wants_file(cls, name, header):
+        '''Decide whether this parser may read a file, given only its name and the beginning of its contents
+
+        Used to skip files that no parser will read, such as when unpacking archives.
+
+        Input:
+            name - str, name of the file
+            header - str, first few KB of the file (see `read_header`)
+        Returns:
+            bool, whether the parser may read this file
+        '''
+        return True
+
     @classmethod
     def generate_from_directory(cls, directory):
         """Create a parser by defining which input files it will read from.
@@ -128,6 +180,22 @@ class DFTParser(object):
     def get_output_structure(self):
         '''Get the output structure, if available
         
+        Returns:
+            ase.Atoms - Output structure from this calculation
+                or None if output file not found
+        '''
+
+        # Check for cached result
+        if self._output_structure is None:
+            self._output_structure = self._get_output_structure()
+        return self._output_structure
+
+    def _get_output_structure(self):
+        '''Read the output structure from the output files
+
+        Hidden operation: self.get_output_structure() is the public
+        interface, which may draw from a cached result
+
         Returns:
             ase.Atoms - Output structure from this calculation
                 or None if output file not found
@@ -153,9 +221,7 @@ class DFTParser(object):
 
     def get_positions(self):
         strc = self.get_output_structure()
-        raw = strc.positions.tolist()
-        wrapped = [[Scalar(value=x) for x in y] for y in raw]
-        return Property(vectors=wrapped)
+        return ArrayProperty(vectors=strc.positions.copy())
 
     def get_cutoff_energy(self):
         '''Read the cutoff energy from the output
@@ -318,3 +384,53 @@ class DFTParser(object):
         Returns: Property, where volume is a scalar.
         """
         raise NotImplementedError
+
+    def iter_steps(self, stride=1):
+        '''Read the ionic steps of the calculation, one at a time
+
+        The output is read as the steps are requested, so only one step is held in memory at a time.
+
+        Input:
+            stride - int, only yield every `stride`-th step, starting with the first. Must be at least 1
+        Yields:
+            dict, describing one ionic step, with keys
+                'step' -> int, index of the step, counting from 0
+                'energy' -> float, total energy (eV)
+                'positions' -> 2D array, cartesian coordinates of the atoms (Angstrom), or None if they were not printed
+                'forces' -> 2D array, forces on the atoms (eV/Angstrom), or None if they were not computed
+                'stress' -> 2D array, stress tensor (kbar), or None if it was not computed
+                'volume' -> float, volume of the cell (Angstrom^3), or None if the cell was not printed
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def _check_stride(stride):
+        '''Make sure a stride between ionic steps is valid (see `iter_steps`)'''
+        if stride < 1:
+            raise ValueError('The stride between ionic steps must be at least 1, not {}'.format(stride))
+
+    def get_trajectory(self, stride=1):
+        '''Get the energy, positions, forces, stress and volume of each ionic step (see `iter_steps`)
+
+        Input:
+            stride - int, only keep every `stride`-th step, starting with the first
+        Returns: Property, where the energy of each step is a scalar, and the step index, positions, forces, stress
+            and volume of each step are conditions. Positions, forces, stresses and volumes are left out unless every
+            step has them.
+            None if there are no ionic steps
+        '''
+        columns = dict((key, []) for key in ('step', 'energy', 'positions', 'forces', 'stress', 'volume'))
+        for step in self.iter_steps(stride):
+            for key, values in columns.items():
+                values.append(step[key])
+        if len(columns['step']) == 0:
+            return None
+
+        conditions = [ArrayValue(name='Ionic step', scalars=np.array(columns['step']))]
+        for key, name, units in (('positions', 'Positions', 'Angstrom'), ('forces', 'Forces', 'eV/Angstrom'),
+                                 ('stress', 'Stress', 'kbar')):
+            if all(x is not None for x in columns[key]):
+                conditions.append(ArrayValue(name=name, matrices=np.array(columns[key]), units=units))
+        if all(x is not None for x in columns['volume']):
+            conditions.append(ArrayValue(name='Volume', scalars=np.array(columns['volume']), units='Angstrom^3'))
+        return ArrayProperty(scalars=np.array(columns['energy']), units='eV', conditions=conditions)
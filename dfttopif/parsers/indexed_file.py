@@ -0,0 +1,68 @@
+import mmap
+import os
+
+
+class IndexedFile(object):
+    '''Memory-mapped view of a text file, for finding marker strings and reading the bytes between them
+
+    Markers are found by searching the mapped file, so only the pages that are searched or read are loaded, and
+     a file can be cut into pieces without reading it line by line. Close the file once done, or use it as a
+     context manager.
+    '''
+
+    def __init__(self, path):
+        '''Map a file into memory
+
+        Input:
+            path - str, path to the file
+        '''
+        self.path = path
+        with open(path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size > 0:
+                self._data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # mmap refuses to map empty files
+                self._data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Unmap the file'''
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+
+    def _line_start(self, pos):
+        '''Get the offset of the beginning of the line holding a certain byte'''
+        return self._data.rfind(b'\n', 0, pos) + 1
+
+    def find(self, search_string):
+        '''Get the offset of the first line containing a string
+
+        Returns:
+            int, offset of the line, or None if the string does not appear'''
+        pos = self._data.find(search_string.encode('utf-8'))
+        if pos == -1:
+            return None
+        return self._line_start(pos)
+
+    def last_offset(self, search_string, end=None):
+        '''Get the offset of the last line containing a string, searching backwards from the end of the file
+
+        Input:
+            search_string - str, string to search for
+            end - int, offset where to start searching backwards from. Defaults to the end of the file
+        Returns:
+            int, offset of the line, or None if the string does not appear'''
+        pos = self._data.rfind(search_string.encode('utf-8'), 0, len(self._data) if end is None else end)
+        if pos == -1:
+            return None
+        return self._line_start(pos)
+
+    def read(self, start=0, end=None):
+        '''Get the raw bytes between two offsets'''
+        return self._data[start:end]
@@ -1,12 +1,18 @@
 from pypif.obj.common import Property, Scalar
 
-from .base import DFTParser, Value_if_true, InvalidIngesterException
+from .base import DFTParser, Value_if_true, InvalidIngesterException, read_header
+from .arrays import ArrayProperty, ArrayValue
+import numpy as np
 import os
 from pypif.obj.common.value import Value
 from dftparse.pwscf.stdout_parser import PwscfStdOutputParser
 from ase import Atoms
 
 
+bohr_to_angstrom = 0.529177249
+rydberg_to_ev = 13.605693012183622
+
+
 class PwscfParser(DFTParser):
     '''
     Parser for PWSCF calculations
@@ -18,29 +24,32 @@ class PwscfParser(DFTParser):
         self.all_parsed_data = {}
         parser = PwscfStdOutputParser()
 
-        # Look for appropriate files
-        self.inputf = self.outputf = None
+        # Look for appropriate files, deciding what each one holds from its header
+        self.file_roles = dict((f, self._classify(read_header(f))) for f in self._files)
+        self.inputf = self.outputf = self.dosf = None
         for f in self._files:
-            try:
-                if self._get_line('Program PWSCF', f, return_string=False):
-                    if self.outputf is not None:
-                        raise InvalidIngesterException('More than one output file!')
-                    self.outputf = f
-                elif self._get_line('&control', f, return_string=False, case_sens=False):
-                    if self.inputf is not None:
-                        raise InvalidIngesterException('More than one input file')
-                    self.inputf = f
-            except UnicodeDecodeError as e:
-                pass
+            role = self.file_roles[f]
+            if role == 'output':
+                if self.outputf is not None:
+                    raise InvalidIngesterException('More than one output file!')
+                self.outputf = f
+            elif role == 'input':
+                if self.inputf is not None:
+                    raise InvalidIngesterException('More than one input file')
+                self.inputf = f
+            elif role == 'dos' and self.dosf is None:
+                self.dosf = f
+        self._dos_data = None
 
         if self.inputf is None:
             raise InvalidIngesterException('Failed to find input file')
         if self.outputf is None:
             raise InvalidIngesterException('Failed to find output file')
 
-        # Read in the settings
+        # Read the output once, collecting both the dftparse output and the markers used by the getters
+        self._output_record = self._new_output_record()
         with open(self.outputf, "r") as f:
-            for line in parser.parse(f.readlines()):
+            for line in parser.parse(self._scan_output(f, self._output_record)):
                 self.settings.update(line)
                 for k, v in line.items():
                     if k in self.all_parsed_data:
@@ -48,6 +57,35 @@ class PwscfParser(DFTParser):
                     else:
                         self.all_parsed_data[k] = [v]
 
+    @classmethod
+    def sniff(cls, files):
+        # pw.x prints its name at the very top of its output
+        return any('Program PWSCF' in read_header(f) for f in files if os.path.isfile(f))
+
+    @classmethod
+    def wants_file(cls, name, header):
+        # Output, input and DOS files are recognized from their contents
+        return cls._classify(header) is not None
+
+    @staticmethod
+    def _classify(header):
+        '''Decide what a file holds from its first few KB (see `read_header`)
+
+        Input:
+            header - str, beginning of the file
+        Returns:
+            str, 'output' (pw.x output), 'input' (pw.x input) or 'dos' (total DOS, as written by dos.x or
+                projwfc.x), or None for any other file
+        '''
+        first_line = header.split('\n', 1)[0]
+        if 'Program PWSCF' in header:
+            return 'output'
+        if '&control' in header.lower():
+            return 'input'
+        if "E (eV)" in first_line and "Int dos(E)" in first_line:
+            return 'dos'
+        return None
+
     def get_result_functions(self):
         base_results = super(PwscfParser, self).get_result_functions()
         base_results["One-electron energy contribution"] = "get_one_electron_energy_contribution"
@@ -58,6 +96,83 @@ class PwscfParser(DFTParser):
 
     def get_name(self): return "PWSCF"
 
+    @staticmethod
+    def _new_output_record():
+        '''Create an empty record of the output markers and blocks used by the getters'''
+        return {
+            'natoms': None, 'natomtypes': None, 'alat': None, 'Fermi energy': None,
+            'crystal axes': None, 'initial positions': None, 'LDA+U': None, 'final coordinates': None,
+            'pseudopotentials': [],
+            'relaxation': False, 'relaxation converged': False, 'scf converged': False, 'spin-orbit': False,
+        }
+
+    @staticmethod
+    def _scan_output(lines, record):
+        '''Record the markers and blocks needed by the getters while passing each line through
+
+        Like the searches they replace, markers and blocks keep their first occurrence, except for the
+        pseudopotential names, which are all listed. Blocks are stored as lists of lines for the getters
+        to interpret.
+
+        Input:
+            lines - iterable of str, lines of the pw.x output
+            record - dict, record to fill (see _new_output_record)
+        Yields:
+            str, each line of `lines`
+        '''
+        captures = []  # [list of lines, number of lines still wanted] for each block being read
+        in_final = False
+        for line in lines:
+            # Collect the lines of the blocks started by earlier markers
+            if captures:
+                for capture in captures:
+                    capture[0].append(line)
+                    capture[1] -= 1
+                captures = [x for x in captures if x[1] > 0]
+            if in_final:
+                record['final coordinates'].append(line)
+                in_final = 'End final coordinates' not in line
+
+            if record['natoms'] is None and 'number of atoms/cell' in line:
+                record['natoms'] = int(float(line.split('=')[-1]))
+            elif record['natomtypes'] is None and 'number of atomic types' in line:
+                record['natomtypes'] = int(line.split()[5])
+            elif record['alat'] is None and 'lattice parameter (alat)' in line:
+                record['alat'] = float(line.split('=')[-1].split()[0])
+            elif record['Fermi energy'] is None and 'the Fermi energy is' in line:
+                record['Fermi energy'] = float(line.split('is')[-1].split()[0])
+            elif 'PseudoPot. #' in line:
+                captures.append([record['pseudopotentials'], 1])
+            elif record['crystal axes'] is None and 'crystal axes:' in line:
+                record['crystal axes'] = []
+                captures.append([record['crystal axes'], 3])
+            elif record['initial positions'] is None and \
+                    all(x in line for x in ["site n.", "atom", "positions", "alat units"]):
+                record['initial positions'] = []
+                captures.append([record['initial positions'], record['natoms'] or 0])
+            elif record['LDA+U'] is None and 'LDA+U calculation' in line:
+                record['LDA+U'] = [line]
+                captures.append([record['LDA+U'], 15])
+            elif record['final coordinates'] is None and 'Begin final coordinates' in line:
+                record['final coordinates'] = [line]
+                in_final = True
+            elif 'Geometry Optimization' in line:
+                record['relaxation'] = True
+                if 'End of' in line:
+                    record['relaxation converged'] = True
+            elif 'convergence has been achieved' in line:
+                record['scf converged'] = True
+            elif 'with spin-orbit' in line:
+                record['spin-orbit'] = True
+
+            yield line
+
+    def _get_marker(self, key, search_string):
+        '''Get a marker of the output record, which must have been found'''
+        if self._output_record[key] is None:
+            raise Exception('%s not found in %s'%(search_string, self.outputf))
+        return self._output_record[key]
+
     def _get_key_with_units(self, key):
         if key not in self.settings:
             return None
@@ -109,17 +224,17 @@ class PwscfParser(DFTParser):
     @Value_if_true
     def is_relaxed(self):
         '''Determine if relaxation run from the output'''
-        return self._get_line('Geometry Optimization', self.outputf, return_string=False)
+        return self._output_record['relaxation']
 
     def _is_converged(self):
         '''Determine if calculation converged; for a relaxation (static) run
         we look for ionic (electronic) convergence in the output'''
         if self.is_relaxed():
             # relaxation run case
-            return self._get_line(['End of', 'Geometry Optimization'], self.outputf, return_string=False)
+            return self._output_record['relaxation converged']
         else:
             # static run case
-            return self._get_line('convergence has been achieved', self.outputf, return_string=False)
+            return self._output_record['scf converged']
 
     def get_KPPRA(self):
         '''Determine the no. of k-points in the BZ (from the input) times the
@@ -158,7 +273,7 @@ class PwscfParser(DFTParser):
                     for k in range(int(fp[l+1].split()[0])):
                         nk += int(float(fp[l+2+k].split()[3]))
                 # Find the no. of atoms
-                natoms = int(self._get_line('number of atoms/cell', self.outputf).split()[4])
+                natoms = self._get_marker('natoms', 'number of atoms/cell')
                 return Value(scalars=[Scalar(value=nk*natoms)])
         fp.close()
         raise Exception('%s not found in %s'%('KPOINTS',self.inputf))
@@ -166,43 +281,39 @@ class PwscfParser(DFTParser):
     @Value_if_true
     def uses_SOC(self):
         '''Looks for line with "with spin-orbit" in the output'''
-        return self._get_line('with spin-orbit', self.outputf, return_string=False)
+        return self._output_record['spin-orbit']
 
     def get_pp_name(self):
         '''Determine the pseudopotential names from the output'''
-        ppnames = []
         # Find the number of atom types
-        natomtypes = int(self._get_line('number of atomic types', self.outputf).split()[5])
-        # Find the pseudopotential names
-        with open(self.outputf) as fp:
-            for line in fp:
-                if "PseudoPot. #" in line:
-                    ppnames.append(Scalar(value=next(fp).split('/')[-1].rstrip()))
-                    if len(ppnames) == natomtypes:
-                        return Value(scalars=ppnames)
+        natomtypes = self._get_marker('natomtypes', 'number of atomic types')
+        # Find the pseudopotential names, listed on the line after each "PseudoPot. #"
+        lines = self._output_record['pseudopotentials']
+        if len(lines) < natomtypes:
             raise Exception('Could not find %i pseudopotential names'%natomtypes)
+        return Value(scalars=[Scalar(value=line.split('/')[-1].rstrip()) for line in lines[:natomtypes]])
 
     def get_U_settings(self):
         '''Determine the DFT+U type and parameters from the output'''
-        with open(self.outputf) as fp:
-            for line in fp:
-                if "LDA+U calculation" in line:
-                    U_param = {}
-                    U_param['Type'] = line.split()[0]
-                    U_param['Values'] = {}
-                    # look through next several lines
-                    for nl in range(15):
-                        line2 = next(fp).split()
-                        if len(line2) > 1 and line2[0] == "atomic":
-                            pass # column titles
-                        elif len(line2) == 6:
-                            U_param['Values'][line2[0]] = {}
-                            U_param['Values'][line2[0]]['L'] = float(line2[1])
-                            U_param['Values'][line2[0]]['U'] = float(line2[2])
-                            U_param['Values'][line2[0]]['J'] = float(line2[4])
-                        else: break # end of data block
-                    return Value(**U_param)
+        if self._output_record['LDA+U'] is None:
             return None
+        fp = iter(self._output_record['LDA+U'])
+        line = next(fp)
+        U_param = {}
+        U_param['Type'] = line.split()[0]
+        U_param['Values'] = {}
+        # look through next several lines
+        for nl in range(15):
+            line2 = next(fp).split()
+            if len(line2) > 1 and line2[0] == "atomic":
+                pass # column titles
+            elif len(line2) == 6:
+                U_param['Values'][line2[0]] = {}
+                U_param['Values'][line2[0]]['L'] = float(line2[1])
+                U_param['Values'][line2[0]]['U'] = float(line2[2])
+                U_param['Values'][line2[0]]['J'] = float(line2[4])
+            else: break # end of data block
+        return Value(**U_param)
 
     def get_vdW_settings(self):
         '''Determine the vdW type if using vdW xc functional or correction
@@ -234,38 +345,30 @@ class PwscfParser(DFTParser):
         wrapped = [[Scalar(value=x) for x in y] for y in self.settings["stress"]]
         return Property(matrices=[wrapped], units=self.settings["stress units"])
 
-    def get_output_structure(self):
+    def _get_output_structure(self):
         '''Determine the structure from the output'''
-        bohr_to_angstrom = 0.529177249
+        record = self._output_record
 
         # determine the number of atoms
-        natoms = int(float(self._get_line('number of atoms/cell', self.outputf).split('=')[-1]))
+        natoms = self._get_marker('natoms', 'number of atoms/cell')
 
         # determine the initial lattice parameter
-        alat = float(self._get_line('lattice parameter (alat)', self.outputf).split('=')[-1].split()[0])
+        alat = self._get_marker('alat', 'lattice parameter (alat)')
 
         # find the initial unit cell
         unit_cell = []
-        with open(self.outputf, 'r') as fp:
-            for line in fp:
-                if "crystal axes:" in line:
-                    for i in range(3):
-                        unit_cell.append([float(j)*alat*bohr_to_angstrom for j in next(fp).split('(')[-1].split(')')[0].split()])
-                    break
-            if len(unit_cell) == 0: raise Exception('Cannot find the initial unit cell')
+        if record['crystal axes'] is None: raise Exception('Cannot find the initial unit cell')
+        for line in record['crystal axes']:
+            unit_cell.append([float(j)*alat*bohr_to_angstrom for j in line.split('(')[-1].split(')')[0].split()])
 
         # find the initial atomic coordinates
         coords = [] ; atom_symbols = []
-        with open(self.outputf, 'r') as fp:
-            for line in fp:
-                if "site n." in line and "atom" in line and "positions" in line and "alat units" in line:
-                    for i in range(natoms):
-                        coordline = next(fp)
-                        atom_symbols.append(''.join([i for i in coordline.split()[1] if not i.isdigit()]))
-                        coord_conv_factor = alat*bohr_to_angstrom
-                        coords.append([float(j)*coord_conv_factor for j in coordline.rstrip().split('=')[-1].split('(')[-1].split(')')[0].split()])
-                    break
-            if len(coords) == 0: raise Exception('Cannot find the initial atomic coordinates')
+        if record['initial positions'] is None or natoms == 0:
+            raise Exception('Cannot find the initial atomic coordinates')
+        for coordline in record['initial positions']:
+            atom_symbols.append(''.join([i for i in coordline.split()[1] if not i.isdigit()]))
+            coord_conv_factor = alat*bohr_to_angstrom
+            coords.append([float(j)*coord_conv_factor for j in coordline.rstrip().split('=')[-1].split('(')[-1].split(')')[0].split()])
 
         if type(self.is_relaxed()) == type(None):
             # static run: create, populate, and return the initial structure
@@ -274,85 +377,150 @@ class PwscfParser(DFTParser):
             return structure
         else:
             # relaxation run: update with the final structure
-            with open(self.outputf) as fp:
-                for line in fp:
-                    if "Begin final coordinates" in line:
-                        if 'new unit-cell volume' in next(fp):
-                            # unit cell allowed to change
-                            cellheader = next(fp)
-                            # skip irrelevant lines (density/blank line/etc)
-                            while 'CELL_PARAMETER' not in cellheader:
-                                cellheader = next(fp)
-                            # get the final unit cell
-                            unit_cell = []
-                            if 'bohr' in cellheader.lower():
-                                cell_conv_factor = bohr_to_angstrom
-                            elif 'angstrom' in cellheader.lower():
-                                cell_conv_factor = 1.0
-                            else:
-                                alat = float(cellheader.split('alat=')[-1].replace(')', ''))
-                                cell_conv_factor = alat*bohr_to_angstrom
-                            for i in range(3):
-                                unit_cell.append([float(j)*cell_conv_factor for j in next(fp).split()])
-                            next(fp) # blank line
-
-                        # get the final atomic coordinates
-                        coordtype = next(fp).split()[-1].replace('(', '').replace(')', '')
-                        if coordtype == 'bohr':
-                            coord_conv_factor = bohr_to_angstrom
-                        elif coordtype == 'angstrom' or coordtype == 'crystal':
-                            coord_conv_factor = 1.0
-                        else:
-                            coord_conv_factor = alat*bohr_to_angstrom
-                        coords = [] # reinitialize the coords
-                        for i in range(natoms):
-                            coordline = next(fp).split()
-                            coords.append([float(j)*coord_conv_factor for j in coordline[1:4]])
-
-                        # create, populate, and return the final structure
-                        structure = Atoms(symbols=atom_symbols, cell=unit_cell, pbc=True)
-                        if coordtype == 'crystal':
-                            structure.set_scaled_positions(coords) # direct coord
-                        else:
-                            structure.set_positions(coords) # cartesian coord
-                        return structure
-                raise Exception('Cannot find the final coordinates')
+            if record['final coordinates'] is None: raise Exception('Cannot find the final coordinates')
+            fp = iter(record['final coordinates'])
+            next(fp)
+            if 'new unit-cell volume' in next(fp):
+                # unit cell allowed to change
+                cellheader = next(fp)
+                # skip irrelevant lines (density/blank line/etc)
+                while 'CELL_PARAMETER' not in cellheader:
+                    cellheader = next(fp)
+                # get the final unit cell
+                unit_cell = []
+                if 'bohr' in cellheader.lower():
+                    cell_conv_factor = bohr_to_angstrom
+                elif 'angstrom' in cellheader.lower():
+                    cell_conv_factor = 1.0
+                else:
+                    alat = float(cellheader.split('alat=')[-1].replace(')', ''))
+                    cell_conv_factor = alat*bohr_to_angstrom
+                for i in range(3):
+                    unit_cell.append([float(j)*cell_conv_factor for j in next(fp).split()])
+                next(fp) # blank line
+
+            # get the final atomic coordinates
+            coordtype = next(fp).split()[-1].replace('(', '').replace(')', '')
+            if coordtype == 'bohr':
+                coord_conv_factor = bohr_to_angstrom
+            elif coordtype == 'angstrom' or coordtype == 'crystal':
+                coord_conv_factor = 1.0
+            else:
+                coord_conv_factor = alat*bohr_to_angstrom
+            coords = [] # reinitialize the coords
+            for i in range(natoms):
+                coordline = next(fp).split()
+                coords.append([float(j)*coord_conv_factor for j in coordline[1:4]])
+
+            # create, populate, and return the final structure
+            structure = Atoms(symbols=atom_symbols, cell=unit_cell, pbc=True)
+            if coordtype == 'crystal':
+                structure.set_scaled_positions(coords) # direct coord
+            else:
+                structure.set_positions(coords) # cartesian coord
+            return structure
+
+    def iter_steps(self, stride=1):
+        self._check_stride(stride)
+        # Each step starts with its total energy, followed by the forces and stresses. The geometry of a step is
+        #  the last one printed before its energy: the initial one in the header, then each updated one
+        index = 0
+        step = None
+        alat = natoms = cell = positions = None
+        with open(self.outputf, "r") as fp:
+            for line in fp:
+                if 'lattice parameter (alat)' in line:
+                    alat = float(line.split('=')[-1].split()[0])
+                elif 'number of atoms/cell' in line:
+                    natoms = int(line.split('=')[-1])
+                elif 'crystal axes:' in line:
+                    cell = np.array([[float(x) for x in next(fp).split('(')[-1].split(')')[0].split()]
+                                     for _ in range(3)]) * alat * bohr_to_angstrom
+                elif 'positions (alat units)' in line:
+                    positions = np.array([[float(x) for x in next(fp).split('(')[-1].split(')')[0].split()]
+                                          for _ in range(natoms)]) * alat * bohr_to_angstrom
+                elif line.startswith('CELL_PARAMETERS'):
+                    if 'bohr' in line.lower():
+                        factor = bohr_to_angstrom
+                    elif 'angstrom' in line.lower():
+                        factor = 1.0
+                    else:
+                        factor = float(line.split('alat=')[-1].replace(')', '')) * bohr_to_angstrom
+                    cell = np.array([[float(x) for x in next(fp).split()] for _ in range(3)]) * factor
+                elif line.startswith('ATOMIC_POSITIONS'):
+                    coordtype = line.split()[-1].strip('(){}').lower()
+                    positions = np.array([[float(x) for x in next(fp).split()[1:4]] for _ in range(natoms)])
+                    if coordtype == 'crystal':
+                        positions = positions.dot(cell)
+                    elif coordtype == 'bohr':
+                        positions *= bohr_to_angstrom
+                    elif coordtype != 'angstrom':
+                        positions *= alat * bohr_to_angstrom
+                elif line.startswith('!') and 'total energy' in line:
+                    if step is not None:
+                        yield step
+                    step = None
+                    if index % stride == 0:
+                        step = {
+                            'step': index,
+                            'energy': float(line.split('=')[-1].split()[0]) * rydberg_to_ev,
+                            'positions': positions,
+                            'forces': None,
+                            'stress': None,
+                            'volume': None if cell is None else abs(np.linalg.det(cell)),
+                        }
+                    index += 1
+                elif step is None:
+                    continue
+                elif 'Forces acting on atoms' in line:
+                    # The total forces come first, and are followed by their contributions in verbose runs
+                    rows = []
+                    while len(rows) < natoms:
+                        row = next(fp)
+                        if 'force =' in row:
+                            rows.append([float(x) for x in row.split('=')[-1].split()])
+                    step['forces'] = np.array(rows) * (rydberg_to_ev / bohr_to_angstrom)
+                elif 'total   stress' in line:
+                    step['stress'] = np.array([[float(x) for x in next(fp).split()[-3:]] for _ in range(3)])
+        if step is not None:
+            yield step
+
+    def _get_dos_data(self):
+        '''Load the total DOS into arrays, the first time it is needed
+
+        Returns: (energy, dos), or None if there is no DOS file, where
+            energy - 1D array, energies shifted by the Fermi energy (eV)
+            dos - 1D array, DOS summed over the spin channels
+        '''
+        if self.dosf is None:
+            return None # cannot find DOS
+        if self._dos_data is None:
+            # get the Fermi energy
+            efermi = self._get_marker('Fermi energy', 'the Fermi energy is')
+
+            # grab the DOS
+            with open(self.dosf, 'r') as fp:
+                next(fp) # comment line
+                text = fp.read()
+            ncol = len(text[:text.find('\n')].split())
+            ndoscol = ncol-2 # number of spin channels
+            data = np.fromstring(text, sep=' ').reshape(-1, ncol)
+            self._dos_data = (data[:, 0] - efermi, data[:, 1:1+ndoscol].sum(axis=1))
+        return self._dos_data
 
     def get_dos(self):
         '''Find the total DOS shifted by the Fermi energy'''
-        # find the dos file
-        fildos = ''
-        for f in self._files:
-            with open(f, 'r') as fp:
-                first_line = next(fp)
-                if "E (eV)" in first_line and "Int dos(E)" in first_line:
-                    fildos = f
-                    ndoscol = len(next(fp).split())-2 # number of spin channels
-                    fp.close()
-                    break
-                fp.close()
-        if not fildos:
+        dos_data = self._get_dos_data()
+        if dos_data is None:
             return None # cannot find DOS
-
-        # get the Fermi energy
-        line = self._get_line('the Fermi energy is', self.outputf)
-        efermi = float(line.split('is')[-1].split()[0])
-
-        # grab the DOS
-        energy = [] ; dos = []
-        fp = open(fildos, 'r')
-        next(fp) # comment line
-        for line in fp:
-            ls = line.split()
-            energy.append(Scalar(value=float(ls[0])-efermi))
-            dos.append(Scalar(value=sum([float(i) for i in ls[1:1+ndoscol]])))
-        return Property(scalars=dos, units='number of states per unit cell', conditions=Value(name='energy', scalars=energy, units='eV'))
+        energy, dos = dos_data
+        return ArrayProperty(scalars=dos, units='number of states per unit cell',
+                             conditions=ArrayValue(name='energy', scalars=energy, units='eV'))
 
     def get_forces(self):
         if "forces" not in self.settings:
             return None
-        wrapped = [[Scalar(value=x) for x in y] for y in self.settings['forces']]
-        return Property(vectors=wrapped, units=self.settings['force units'])
+        return ArrayProperty(vectors=np.array(self.settings['forces']), units=self.settings['force units'])
 
     def get_total_force(self):
         if "total force" not in self.settings:
@@ -370,18 +538,17 @@ class PwscfParser(DFTParser):
 
     def get_band_gap(self):
         '''Compute the band gap from the DOS'''
-        dosdata = self.get_dos()
-        if type(dosdata) == type(None):
+        dos_data = self._get_dos_data()
+        if dos_data is None:
             return None # cannot find DOS
         else:
-            energy = dosdata.conditions.scalars
-            dos = dosdata.scalars
-            step_size = energy[1].value - energy[0].value
+            energy, dos = [x.tolist() for x in dos_data]
+            step_size = energy[1] - energy[0]
             not_found = True ; l = 0 ; bot = 10**3 ; top = -10**3
             while not_found and l < len(dos):
                 # iterate through the data
-                e = float(energy[l].value)
-                dens = float(dos[l].value)
+                e = float(energy[l])
+                dens = float(dos[l])
                 # note: dos already shifted by efermi
                 if e < 0 and dens > 1e-3:
                     bot = e
@@ -1,12 +1,45 @@
 from pypif.obj import Property, Scalar
 
 from .base import DFTParser, Value_if_true, InvalidIngesterException
+from .indexed_file import IndexedFile
+from .arrays import ArrayProperty, ArrayValue
+import io
 import os
 import re
+import itertools
+import numpy as np
 from ase.io.vasp import read_vasp_out
 from pypif.obj import Value, FileReference
 from dftparse.vasp.outcar_parser import OutcarParser
-from dftparse.vasp.eigenval_parser import EigenvalParser
+
+
+_iteration_re = re.compile(r'([0-9]+)\( *([0-9]+)\)')
+
+# Numbers in the tables of the OUTCAR, which VASP sometimes prints without spaces between them
+_float_re = re.compile(r'-?[0-9]+\.[0-9]+')
+
+
+def compact_outcar(path):
+    '''Extract the parts of an OUTCAR that describe the final state of the calculation
+
+    Keeps the header, which lists the parameters of the calculation, and everything from the last electronic
+     iteration of the last complete ionic step on, which holds the summary of that step (energies, forces,
+     stresses) and the timing. The ionic steps in between are dropped. This is what the quality report and the
+     final structure need. A step is complete once its forces are printed, so a run interrupted in the middle of
+     a step keeps its previous step. If no step is complete, the whole OUTCAR is returned.
+
+    Input:
+        path - str, path to the OUTCAR
+    Returns:
+        bytes, reduced OUTCAR
+    '''
+    with IndexedFile(path) as outcar:
+        first = outcar.find('- Iteration')
+        forces = outcar.last_offset('TOTAL-FORCE')
+        last = outcar.last_offset('- Iteration', forces) if forces is not None else None
+        if first is None or last is None:
+            return outcar.read()
+        return outcar.read(0, first) + outcar.read(last)
 
 
 class VaspParser(DFTParser):
@@ -35,8 +68,10 @@ class VaspParser(DFTParser):
         if self.outcar is None:
             raise InvalidIngesterException('OUTCAR not found!')
 
+        # Read the OUTCAR once, collecting both the dftparse output and the markers used by the getters
+        self._outcar_record = self._new_outcar_record()
         with open(self.outcar, "r") as fr:
-            for parsed_line in parser.parse(fr.readlines()):
+            for parsed_line in parser.parse(self._scan_outcar(fr, self._outcar_record)):
                 for k, v in parsed_line.items():
                     if k in self.settings:
                         self.settings[k].append(v)
@@ -48,12 +83,124 @@ class VaspParser(DFTParser):
         self.incar = _find_file('INCAR')
         self.poscar = _find_file('POSCAR')
         self.doscar = _find_file('DOSCAR')
-        self.eignval = _find_file('EIGNVAL')
+        self.eignval = _find_file('EIGENVAL')
+        self._doscar_data = None
+        self._eigenval_data = None
+
+    @classmethod
+    def wants_file(cls, name, header):
+        # Only these files are read, large ones such as the WAVECAR or CHGCAR are not
+        return os.path.basename(name).upper().startswith(('OUTCAR', 'INCAR', 'POSCAR', 'DOSCAR', 'EIGENVAL'))
+
+    @classmethod
+    def sniff(cls, files):
+        # VASP calculations are identified by their OUTCAR
+        return any(os.path.basename(f).upper().startswith('OUTCAR') for f in files)
 
     def get_name(self): return "VASP"
+
+    @staticmethod
+    def _new_outcar_record():
+        """Create an empty record of the OUTCAR markers used by the getters"""
+        return {
+            'ENCUT': None, 'LSORBIT': None, 'NSW': None, 'NELM': None, 'vasp': None,
+            'NIONS': None, 'NKPTS': None, 'LDAUTYPE': None, 'LDAUL': None, 'LDAUU': None, 'LDAUJ': None,
+            'GGA': None, 'external pressure': None, 'in kB': None, 'TOTEN': None,
+            'TITEL': [], 'kpoint weights': [],
+            'irreducible': False, 'LDAU': False, 'LUSE_VDW': False, 'ISIF = 0': False, 'ISIF = 1': False,
+            'electronic steps': None, 'converged': False,
+        }
+
+    @staticmethod
+    def _scan_outcar(lines, record):
+        """Record the markers needed by the getters while passing each line through
+
+        Settings such as ENCUT keep their first occurrence, while results such as the
+        total energy keep their last one. Split lines are stored for the getters to
+        interpret. Values that cannot be parsed are left as None, so that only the
+        getters that need them fail.
+
+        Input:
+            lines - iterable of str, lines of the OUTCAR
+            record - dict, record to fill (see _new_outcar_record)
+        Yields:
+            str, each line of `lines`
+        """
+        in_weights = False
+        for line in lines:
+            # Collect the k-point weights that follow the listing header
+            if in_weights:
+                words = line.split()
+                if len(words) < 4:
+                    in_weights = False
+                else:
+                    try:
+                        record['kpoint weights'].append(float(words[3]))
+                    except ValueError:
+                        record['kpoint weights'] = None
+                        in_weights = False
+            elif "Coordinates               Weight" in line:
+                in_weights = True
+                record['kpoint weights'] = []
+
+            if "TITEL" in line:
+                record['TITEL'].append(line.split())
+            if "LDAU" in line:
+                record['LDAU'] = True
+                if "LDAUTYPE" in line:
+                    record['LDAUTYPE'] = line.split()
+                if "LDAUL" in line:
+                    record['LDAUL'] = line.split()
+                if "LDAUU" in line:
+                    record['LDAUU'] = line.split()
+                if "LDAUJ" in line:
+                    record['LDAUJ'] = line.split()
+            if "LUSE_VDW" in line:
+                record['LUSE_VDW'] = True
+            if "irreducible" in line:
+                record['irreducible'] = True
+            if "ISIF   =      0" in line:
+                record['ISIF = 0'] = True
+            if "ISIF   =      1" in line:
+                record['ISIF = 1'] = True
+            if "number of ions     NIONS =" in line:
+                record['NIONS'] = line.split()
+            elif "k-points           NKPTS =" in line:
+                record['NKPTS'] = line.split()
+            if "external pressure" in line:
+                record['external pressure'] = line.split()
+            if "in kB" in line:
+                record['in kB'] = line.split()
+            if line.startswith('  free  energy   TOTEN'):
+                record['TOTEN'] = float(line.split()[4])
+
+            # Settings where only the first occurrence counts
+            for key, marker in (('vasp', "vasp"), ('ENCUT', "ENCUT"), ('LSORBIT', "LSORBIT"),
+                                ('NSW', "NSW"), ('GGA', "GGA     =")):
+                if record[key] is None and marker in line:
+                    record[key] = line.split()
+
+            # Determine whether the last ionic step terminates because it converges or because we hit NELM
+            if record['NELM'] is None:
+                if line.startswith("   NELM   ="):
+                    try:
+                        record['NELM'] = int(line.split()[2][:-1])
+                    except (IndexError, ValueError):
+                        pass
+            else:
+                if 'Iteration' in line:
+                    steps = _iteration_re.findall(line)
+                    if steps:
+                        record['electronic steps'] = int(steps[0][1])
+                # If the loop is finished, mark whether it finished before NELM
+                if 'aborting loop' in line and record['electronic steps'] is not None:
+                    record['converged'] = record['electronic steps'] < record['NELM']
+
+            yield line
         
-    def get_output_structure(self):
-        self.atoms = read_vasp_out(self.outcar)
+    def _get_output_structure(self):
+        # Only hand the header and the final step to ase, rather than having it read every step
+        self.atoms = read_vasp_out(io.StringIO(compact_outcar(self.outcar).decode('utf-8', 'replace')))
         return self.atoms
 
     def get_outcar(self):
@@ -83,333 +230,348 @@ class VaspParser(DFTParser):
         )])
 
     def get_cutoff_energy(self):
-        # Open up the OUTCAR
-        with open(self.outcar, 'r') as fp:
-         # Look for ENCUT
-            for line in fp:
-                if "ENCUT" in line:
-                    words = line.split()
-                    return Value(scalars=[Scalar(value=float(words[2]))], units=words[3])
-                
-        # Error handling: ENCUT not found
-        raise Exception('ENCUT not found')
+        # Look for ENCUT
+        words = self._outcar_record['ENCUT']
+        if words is None:
+            raise Exception('ENCUT not found')
+        return Value(scalars=[Scalar(value=float(words[2]))], units=words[3])
 
     @Value_if_true
     def uses_SOC(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-        
-            #look for LSORBIT
-            for line in fp:
-                if "LSORBIT" in line:
-                    words = line.split()
-                    return words[2] == 'T'
-        
-        # Error handling: LSORBIT not found
-        raise Exception('LSORBIT not found')
-        
+        # Look for LSORBIT
+        words = self._outcar_record['LSORBIT']
+        if words is None:
+            raise Exception('LSORBIT not found')
+        return words[2] == 'T'
+
     @Value_if_true
     def is_relaxed(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-        
-            #  Look for NSW
-            for line in fp:
-                if "NSW" in line:
-                    words = line.split()
-                    return int(words[2]) != 0
-                
-        # Error handling: NSW not found
-        raise Exception('NSW not found')
-        
+        # Look for NSW
+        words = self._outcar_record['NSW']
+        if words is None:
+            raise Exception('NSW not found')
+        return int(words[2]) != 0
+
     def get_xc_functional(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-        
-            # Look for TITEL
-            for line in fp:
-                if "TITEL" in line:
-                    words = line.split()
-                    return Value(scalars=[Scalar(value=words[2])])
-            
+        # Look for the first TITEL
+        titels = self._outcar_record['TITEL']
+        if len(titels) == 0:
+            return None
+        return Value(scalars=[Scalar(value=titels[0][2])])
+
     def get_pp_name(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-        
-            #initialize empty list to store pseudopotentials
-            pp = []
-            # Look for TITEL
-            for line in fp:
-                if "TITEL" in line:
-                    words = line.split()
-                    pp.append(words[3])
-            return Value(vectors=[[Scalar(value=x) for x in pp]])
+        # Each TITEL line names one pseudopotential
+        pp = [words[3] for words in self._outcar_record['TITEL']]
+        return Value(vectors=[[Scalar(value=x) for x in pp]])
 
     def get_KPPRA(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-            #store the number of atoms and number of irreducible K-points
-            for line in fp:
-                if "number of ions     NIONS =" in line:
-                    words = line.split()
-                    NI = int(words[11])
-                elif "k-points           NKPTS =" in line:
-                    words = line.split()
-                    NIRK = float(words[3])
-            #check if the number of k-points was reduced by VASP if so, sum all the k-points weight
-            if "irreducible" in open(self.outcar).read():
-                fp.seek(0)
-                for line in fp:
-                    #sum all the k-points weight
-                    if "Coordinates               Weight" in line:
-                        NK=0; counter = 0
-                        for line in fp:
-                            if counter == NIRK:
-                                break
-                            NK += float(line.split()[3])
-                            counter += 1
-                return Value(scalars=[Scalar(value=NI*NK)])
-            #if k-points were not reduced KPPRA equals the number of atoms * number of irreducible k-points
-            else:
-                return Value(scalars=[Scalar(value=NI*NIRK)])
+        record = self._outcar_record
+        # the number of atoms and number of irreducible K-points
+        NI = int(record['NIONS'][11])
+        NIRK = float(record['NKPTS'][3])
+        #check if the number of k-points was reduced by VASP if so, sum all the k-points weight
+        if record['irreducible']:
+            if record['kpoint weights'] is None:
+                raise Exception('Could not read the k-point weights from the OUTCAR')
+            NK = sum(record['kpoint weights'][:int(NIRK)])
+            return Value(scalars=[Scalar(value=NI*NK)])
+        #if k-points were not reduced KPPRA equals the number of atoms * number of irreducible k-points
+        else:
+            return Value(scalars=[Scalar(value=NI*NIRK)])
 
     def _is_converged(self):
         # Follows the procedure used by qmpy, but without reading the whole file into memory
         #   Source: https://github.com/wolverton-research-group/qmpy/blob/master/qmpy/analysis/vasp/calculation.py
+        #   The last ionic step is converged if it terminated before hitting NELM. See _scan_outcar
 
-        with open(self.outcar) as fp:
-            # Part 1: Determine the NELM
-            nelm = None
-            for line in fp:
-                if line.startswith("   NELM   ="):
-                    nelm = int(line.split()[2][:-1])
-                    break
-
-            # If we don't find it, tell the user
-            if nelm is None:
-                raise Exception('NELM not found. Cannot tell if this result is converged')
-
-            # Now, loop through the file. What we want to know is whether the last ionic
-            #   step of this file terminates because it converges or because we hit NELM
-            re_iter = re.compile('([0-9]+)\( *([0-9]+)\)')
-            converged = False
-            for line in fp:
-                # Count the ionic steps
-                if 'Iteration' in line:
-                    ionic, electronic = map(int, re_iter.findall(line)[0])
-
-                # If the loop is finished, mark the number of electronic steps
-                if 'aborting loop' in line:
-                    converged = electronic < nelm
-
-            return converged
+        # If we didn't find NELM, tell the user
+        if self._outcar_record['NELM'] is None:
+            raise Exception('NELM not found. Cannot tell if this result is converged')
+        return self._outcar_record['converged']
 
     def get_total_energy(self):
-        with open(self.outcar) as fp:
-            last_energy = None
-            for line in fp:
-                if line.startswith('  free  energy   TOTEN'):
-                    last_energy = float(line.split()[4])
+        last_energy = self._outcar_record['TOTEN']
         if last_energy is None:
             return None
         return Property(scalars=[Scalar(value=last_energy)], units='eV')
 
     def get_version_number(self):
-        # Open up the OUTCAR
-        with open(self.outcar) as fp:
-        
-            #look for vasp
-            for line in fp:
-                if "vasp" in line:
-                    words = line.split()
-                    return (words[0].strip('vasp.'))
-                    break
-        
-        # Error handling: vasp not found
-        raise Exception('vasp not found')
-        
+        # Look for the first line mentioning vasp
+        words = self._outcar_record['vasp']
+        if words is None:
+            raise Exception('vasp not found')
+        return words[0].strip('vasp.')
+
     def get_U_settings(self):
-        #Open up the OUTCAR
-        with open(self.outcar) as fp:
-            #Check if U is used
-            if "LDAU" in open(self.outcar).read():
-                U_param = {}
-                atoms = []
-                #get the list of pseupotential used
-                for line in fp:
-                    if "TITEL" in line:
-                        atoms.append(line.split()[3])
-                    #Get the U type used
-                    if "LDAUTYPE" in line:
-                            U_param['Type'] = int(line.split()[-1])
-                atoms.reverse()
-                fp.seek(0)
-                #Get the L value
-                U_param['Values'] = {}
-                for line in fp:
-                    for atom, i in zip(atoms, range(len(atoms))):
-                        if "LDAUL" in line:
-                                U_param['Values'][atom] = {'L': int(line.split()[-1-i])}
-                fp.seek(0)
-                #Get the U value            
-                for line in fp:
-                    for atom, i in zip(atoms, range(len(atoms))):
-                        if "LDAUU" in line:
-                                U_param['Values'][atom]['U'] = float(line.split()[-1-i])
-                fp.seek(0)
-                #Get the J value
-                for line in fp:
-                    for atom, i in zip(atoms, range(len(atoms))):
-                        if "LDAUJ" in line:
-                                U_param['Values'][atom]['J'] = float(line.split()[-1-i])
-                return Value(**U_param)
-            #if U is not used, return None
-            else:
-                return None
-            
+        record = self._outcar_record
+        #Check if U is used
+        if record['LDAU']:
+            U_param = {}
+            #get the list of pseupotential used
+            atoms = [words[3] for words in record['TITEL']]
+            #Get the U type used
+            if record['LDAUTYPE'] is not None:
+                U_param['Type'] = int(record['LDAUTYPE'][-1])
+            atoms.reverse()
+            #Get the L, U and J values
+            U_param['Values'] = {}
+            for i, atom in enumerate(atoms):
+                U_param['Values'][atom] = {'L': int(record['LDAUL'][-1-i])}
+            for i, atom in enumerate(atoms):
+                U_param['Values'][atom]['U'] = float(record['LDAUU'][-1-i])
+            for i, atom in enumerate(atoms):
+                U_param['Values'][atom]['J'] = float(record['LDAUJ'][-1-i])
+            return Value(**U_param)
+        #if U is not used, return None
+        else:
+            return None
+
     def get_vdW_settings(self):
         #define the name of the vdW methods in function of their keyword
         vdW_dict = {'BO':'optPBE-vdW', 'MK':'optB88-vdW', 'ML':'optB86b-vdW','RE':'vdW-DF','OR':'Klimes-Bowler-Michaelides'}
-        #Open up the OUTCAR
-        with open(self.outcar) as fp:
-            #Check if vdW is used
-            if "LUSE_VDW" in open(self.outcar).read():
-                #if vdW is used, get its keyword             
-                for line in fp:
-                    if "GGA     =" in line:
-                        words = line.split()
-                        return Value(scalars=[Scalar(value=vdW_dict[words[2]])])
-            #if vdW is not used, return None
-            else:
-                return None
-            
+        #Check if vdW is used
+        if self._outcar_record['LUSE_VDW'] and self._outcar_record['GGA'] is not None:
+            #if vdW is used, get its keyword
+            words = self._outcar_record['GGA']
+            return Value(scalars=[Scalar(value=vdW_dict[words[2]])])
+        #if vdW is not used, return None
+        else:
+            return None
+
     def get_pressure(self):
         #define pressure dictionnary because since when is kB = kbar? Come on VASP people
         pressure_dict = {'kB':'kbar'}
         #Check if ISIF = 0 is used
-        if "ISIF   =      0" in open(self.outcar).read():
+        if self._outcar_record['ISIF = 0']:
             #if ISIF = 0 is used, print this crap
             return None
-        #if ISIF is not 0 then extract pressure and units
-        else:
-            #scan file in reverse to have the final pressure
-            for line in reversed(open(self.outcar).readlines()):
-                if "external pressure" in line:
-                    words = line.split()
-                    return Property(scalars=[Scalar(value=float(words[3]))], units=pressure_dict[words[4]])
-                    break
-    
+        #if ISIF is not 0 then extract the final pressure and units
+        words = self._outcar_record['external pressure']
+        if words is None:
+            return None
+        return Property(scalars=[Scalar(value=float(words[3]))], units=pressure_dict[words[4]])
+
     def get_stresses(self):
-        #Check if ISIF = 0 is used
-        if "ISIF   =      0" in open(self.outcar).read():
+        #Check if ISIF = 0 or ISIF = 1 is used
+        if self._outcar_record['ISIF = 0'] or self._outcar_record['ISIF = 1']:
             return None
-        #Check if ISIF = 1 is used
-        elif "ISIF   =      1" in open(self.outcar).read():
+        #get the final stresses
+        words = self._outcar_record['in kB']
+        if words is None:
             return None
-        else:
-            #scan file in reverse to have the final pressure
-            for line in open(self.outcar).readlines():
-                if "in kB" in line:
-                    words = line.split()
-                    XX = float(words[2]); YY = float(words[3]); ZZ = float(words[4]); XY= float(words[5]); YZ = float(words[6]); ZX = float(words[7])
-            matrix = [[XX,XY,ZX],[XY,YY,YZ],[ZX,YZ,ZZ]]
-            wrapped = [[Scalar(value=x) for x in y] for y in matrix]
-            return Property(matrices=[wrapped], units='kbar')
+        wrapped = [[Scalar(value=x) for x in y] for y in self._stress_matrix(words)]
+        return Property(matrices=[wrapped], units='kbar')
+
+    @staticmethod
+    def _stress_matrix(words):
+        """Arrange the stresses of an "in kB" line of the OUTCAR as a 3x3 matrix
+
+        Input:
+            words - [str], split "in kB" line
+        Returns:
+            [[float]], stress tensor (kbar)
+        """
+        XX = float(words[2]); YY = float(words[3]); ZZ = float(words[4]); XY= float(words[5]); YZ = float(words[6]); ZX = float(words[7])
+        return [[XX,XY,ZX],[XY,YY,YZ],[ZX,YZ,ZZ]]
 
     def get_forces(self):
-        self.atoms = read_vasp_out(self.outcar)
-        forces_raw = self.atoms.get_calculator().results['forces'].tolist()
-        forces_wrapped = [[Scalar(value=x) for x in y] for y in forces_raw]
-        positions_raw = self.atoms.positions.tolist()
-        positions_wrapped = [[Scalar(value=x) for x in y] for y in positions_raw]
-        return Property(
-            vectors=forces_wrapped,
-            conditions=Value(name="positions", vectors=positions_wrapped)
+        # Forces and positions come from the same (cached) final structure
+        atoms = self.get_output_structure()
+        return ArrayProperty(
+            vectors=atoms.get_calculator().results['forces'].copy(),
+            conditions=ArrayValue(name="positions", vectors=atoms.positions.copy())
         )
 
-    @staticmethod
-    def _get_bandgap_from_bands(energies, nelec):
-        """Compute difference in conduction band min and valence band max"""
-        nelec = int(nelec)
-        valence = [x[nelec-1] for x in energies]
-        conduction = [x[nelec] for x in energies]
-        return max(min(conduction) - max(valence), 0.0)
+    def iter_steps(self, stride=1):
+        self._check_stride(stride)
+        # Each ionic step prints the stresses, the cell, the positions and forces, and then the energy
+        natoms = int(self._outcar_record['NIONS'][-1])
+        has_stress = not (self._outcar_record['ISIF = 0'] or self._outcar_record['ISIF = 1'])
+        index = 0
+        stress = cell = positions = forces = None
+        with open(self.outcar, "r") as fr:
+            for line in fr:
+                wanted = index % stride == 0
+                if "in kB" in line:
+                    stress = self._stress_matrix(line.split()) if wanted and has_stress else None
+                elif "direct lattice vectors" in line:
+                    rows = [next(fr) for _ in range(3)]
+                    if wanted:
+                        cell = np.array([[float(x) for x in _float_re.findall(row)[:3]] for row in rows])
+                elif "TOTAL-FORCE" in line:
+                    next(fr)
+                    rows = [next(fr) for _ in range(natoms)]
+                    if wanted:
+                        data = np.array([[float(x) for x in _float_re.findall(row)[:6]] for row in rows])
+                        positions, forces = data[:, :3], data[:, 3:]
+                elif line.startswith('  free  energy   TOTEN'):
+                    if wanted:
+                        yield {
+                            'step': index,
+                            'energy': float(line.split()[4]),
+                            'positions': positions,
+                            'forces': forces,
+                            'stress': None if stress is None else np.array(stress),
+                            'volume': None if cell is None else abs(np.linalg.det(cell)),
+                        }
+                    index += 1
+                    stress = positions = forces = None
+
+    def _get_eigenval_data(self):
+        """Load the EIGENVAL into arrays, the first time it is needed
+
+        Returns: dict, or None if there is no EIGENVAL, with keys
+            'kpoints' -> 2D array, coordinates of each k-point (kpoint, 3)
+            'weights' -> 1D array, weight of each k-point
+            'energies' -> 3D array, band energies (spin, kpoint, band)
+        """
+        if self.eignval is None:
+            return None
+        if self._eigenval_data is None:
+            with open(self.eignval) as fp:
+                ispin = int(next(fp).split()[3])
+                for i in range(4):
+                    next(fp)
+                nkpt, nband = [int(x) for x in next(fp).split()[1:3]]
+
+                # Read one k-point at a time (blank line, coordinates and weight, one line per band)
+                values = None
+                for k in range(nkpt):
+                    block = np.fromstring(''.join(itertools.islice(fp, nband + 2)), sep=' ')
+                    if values is None:
+                        values = np.empty((nkpt, len(block)))
+                    values[k] = block
+
+            # Each k-point holds its coordinates and weight, then one row per band with the index,
+            #  the energy of each spin channel and, in newer versions of VASP, the occupancies
+            bands = values[:, 4:].reshape(nkpt, nband, -1)
+            self._eigenval_data = {
+                'kpoints': values[:, :3],
+                'weights': values[:, 3],
+                'energies': bands[:, :, 1:1+ispin].transpose(2, 0, 1),
+            }
+        return self._eigenval_data
 
     @staticmethod
-    def _get_bandgap_eigenval(eigenval_fname, outcar_fname):
+    def _get_band_edges(energies, nelec):
+        """Locate the band edges of each spin channel
+
+        Input:
+            energies - 3D array, band energies (spin, kpoint, band)
+            nelec - float, number of electrons per spin channel
+        Returns: dict of 1D arrays, one entry per spin channel
+            'valence band maximum', 'conduction band minimum' -> energies of the band edges
+            'vbm kpoint', 'cbm kpoint' -> indices of the k-points where they are found
+            'band gap' -> indirect gap, zero if the bands overlap
+            'direct band gap', 'direct gap kpoint' -> smallest gap at a single k-point and its index
+        """
+        nelec = int(nelec)
+        valence = energies[:, :, nelec-1]
+        conduction = energies[:, :, nelec]
+        direct = conduction - valence
+        edges = {
+            'valence band maximum': valence.max(axis=1),
+            'conduction band minimum': conduction.min(axis=1),
+            'vbm kpoint': valence.argmax(axis=1),
+            'cbm kpoint': conduction.argmin(axis=1),
+            'direct band gap': np.maximum(direct.min(axis=1), 0.0),
+            'direct gap kpoint': direct.argmin(axis=1),
+        }
+        edges['band gap'] = np.maximum(edges['conduction band minimum'] - edges['valence band maximum'], 0.0)
+        return edges
+
+    def _get_bandgap_eigenval(self):
         """Get the bandgap from the EIGENVAL file"""
-        with open(outcar_fname, "r") as f:
-            parser = OutcarParser()
-            nelec = next(iter(filter(lambda x: "number of electrons" in x, parser.parse(f.readlines()))))["number of electrons"]
-        with open(eigenval_fname, "r") as f:
-            eigenval_info = list(EigenvalParser().parse(f.readlines()))
-        # spin_polarized = (2 == len(next(filter(lambda x: "kpoint" in x, eigenval_info))["occupancies"][0]))
-        # if spin_polarized:
-        all_energies = [zip(*x["energies"]) for x in eigenval_info if "energies" in x]
-        spin_energies = zip(*all_energies)
-        gaps = [VaspParser._get_bandgap_from_bands(x, nelec/2.0) for x in spin_energies]
-        return min(gaps)
+        nelec = self.settings["number of electrons"][-1]
+        edges = VaspParser._get_band_edges(self._get_eigenval_data()['energies'], nelec/2.0)
+        return float(edges['band gap'].min())
+
+    def _get_doscar_data(self):
+        """Load the DOSCAR into arrays, the first time it is needed
+
+        Returns: dict, or None if there is no DOSCAR, with keys
+            'efermi' -> float, Fermi energy
+            'energy' -> 1D array, energies at which the DOS was evaluated
+            'dos' -> 2D array, DOS of each spin channel (energy, spin)
+            'integrated dos' -> 2D array, integrated DOS of each spin channel (energy, spin)
+            'total' -> 1D array, DOS summed over the spin channels
+            'projected' -> list of 2D arrays, site-projected DOS of each atom without the energy column
+        """
+        if self.doscar is None:
+            return None
+        if self._doscar_data is None:
+            with open(self.doscar) as fp:
+                # Skip the header. The sixth line describes the energy grid, and is repeated before each site block
+                for i in range(5):
+                    next(fp)
+                blocks = []
+                for line in fp:
+                    words = line.split()
+                    if len(words) < 4:
+                        break
+                    if len(blocks) == 0:
+                        efermi = float(words[3])
+                    rows = list(itertools.islice(fp, int(words[2])))
+                    try:
+                        blocks.append(np.array(''.join(rows).split(), dtype=float).reshape(len(rows), -1))
+                    except ValueError:
+                        if len(blocks) == 0:
+                            raise
+                        break # Unreadable site-projected block, only keep the total DOS
+
+            total = blocks[0]
+            nspin = (total.shape[1] - 1) // 2
+            self._doscar_data = {
+                'efermi': efermi,
+                'energy': total[:, 0],
+                'dos': total[:, 1:1+nspin],
+                'integrated dos': total[:, 1+nspin:1+2*nspin],
+                'total': total[:, 1:1+nspin].sum(axis=1),
+                'projected': [x[:, 1:] for x in blocks[1:]],
+            }
+        return self._doscar_data
 
     @staticmethod
-    def _get_bandgap_doscar(filename):
-        """Get the bandgap from the DOSCAR file"""
-        with open(filename) as fp:
-            for i in range(6):
-                l = fp.readline()
-            efermi = float(l.split()[3])
-            step1 = fp.readline().split()[0]
-            step2 = fp.readline().split()[0]
-            step_size = float(step2)-float(step1)
-            not_found = True
-            while not_found:
-                l = fp.readline().split()
-                e = float(l.pop(0))
-                dens = 0.0
-                for i in range(int(len(l)/2)):
-                    dens += float(l[i])
-                if e < efermi and dens > 1e-3:
-                    bot = e
-                elif e > efermi and dens > 1e-3:
-                    top = e
-                    not_found = False
-            if top - bot < step_size*2:
-                bandgap = 0.0
-            else:
-                bandgap = float(top - bot)
+    def _get_bandgap_doscar(doscar_data):
+        """Get the bandgap from the DOSCAR data (see _get_doscar_data)"""
+        energy = doscar_data['energy']
+        efermi = doscar_data['efermi']
+        step_size = energy[1] - energy[0]
+
+        # Find the highest occupied and lowest unoccupied energies with states
+        has_states = doscar_data['total'] > 1e-3
+        below = energy[has_states & (energy < efermi)]
+        above = energy[has_states & (energy > efermi)]
+        if len(below) == 0 or len(above) == 0:
+            return None
+        bot = below.max()
+        top = above.min()
+        if top - bot < step_size*2:
+            bandgap = 0.0
+        else:
+            bandgap = float(top - bot)
 
         return bandgap
 
     def get_band_gap(self):
         """Get the bandgap, either from the EIGENVAL or DOSCAR files"""
         if self.outcar is not None and self.eignval is not None:
-            bandgap = VaspParser._get_bandgap_eigenval(self.eignval, self.outcar)
+            bandgap = self._get_bandgap_eigenval()
         elif self.doscar is not None:
-            bandgap = VaspParser._get_bandgap_doscar(self.doscar)
+            bandgap = VaspParser._get_bandgap_doscar(self._get_doscar_data())
+            if bandgap is None:
+                return None
         else:
             return None
         return Property(scalars=[Scalar(value=round(bandgap, 3))], units='eV')
-                
+
     def get_dos(self):
-        if self.doscar is None:
+        doscar_data = self._get_doscar_data()
+        if doscar_data is None:
             return None
-        #open DOSCAR
-        with open(self.doscar) as fp:
-            for i in range(6):
-                l = fp.readline()
-            n_step = int(l.split()[2])
-            energy = []; dos = []            
-            for i in range(n_step):
-                l = fp.readline().split()
-                e = float(l.pop(0))
-                energy.append(Scalar(value=e))
-                dens = 0
-                for j in range(int(len(l)/2)):
-                    dens += float(l[j])
-                dos.append(Scalar(value=dens))
-
-            # Convert to property
-            return Property(scalars=dos, units='number of states per unit cell',
-                            conditions=Value(name='energy', scalars=energy, units='eV'))
+        # Convert to property, keeping the arrays until the pif is serialized
+        return ArrayProperty(scalars=doscar_data['total'], units='number of states per unit cell',
+                             conditions=ArrayValue(name='energy', scalars=doscar_data['energy'], units='eV'))
 
     def get_total_magnetization(self):
         if "total magnetization" not in self.settings:
@@ -0,0 +1,140 @@
+import io
+import re
+import json
+import uuid
+import numpy as np
+from pypif.util.case import to_camel_case
+from pypif.util.pif_encoder import PifEncoder
+from pypif.util.serializable import Serializable
+from dfttopif.parsers.arrays import _ArrayFields, _as_dictionaries
+
+
+# Names of pif fields, by attribute name
+_keys = {}
+
+
+def _key(attribute):
+    key = _keys.get(attribute)
+    if key is None:
+        key = _keys[attribute] = to_camel_case(attribute)
+    return key
+
+
+class _Placeholder(object):
+    '''Stands for an array in the output of `_plain`'''
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _plain(obj, arrays):
+    '''Convert pifs into the dictionaries and lists that the json module encodes
+
+    Input:
+        obj - object to convert
+        arrays - list, where to put the arrays of `ArrayProperty` and `ArrayValue` objects. Each one is replaced by
+            a placeholder holding its position in the list. If None, the arrays are converted as pypif would
+    Returns:
+        object ready for the json module
+    '''
+    if isinstance(obj, list):
+        return [_plain(x, arrays) for x in obj]
+    if isinstance(obj, dict):
+        return dict((k, _plain(v, arrays)) for k, v in obj.items())
+    if not isinstance(obj, Serializable):
+        return obj
+    if type(obj).as_dictionary not in (Serializable.as_dictionary, _ArrayFields.as_dictionary):
+        return _plain(obj.as_dictionary(), arrays)
+
+    result = {}
+    for attribute, value in obj.__dict__.items():
+        if value is None:
+            continue
+        if isinstance(value, np.ndarray) and isinstance(obj, _ArrayFields):
+            if arrays is None:
+                value = _as_dictionaries(value.tolist())
+            else:
+                arrays.append(value)
+                value = _Placeholder(len(arrays) - 1)
+        else:
+            value = _plain(value, arrays)
+        result[_key(attribute)] = value
+    return result
+
+
+class _PlaceholderEncoder(PifEncoder):
+    '''Encodes the placeholder of an array as a string holding a token and the position of the array'''
+
+    def __init__(self, token, **kwargs):
+        super(_PlaceholderEncoder, self).__init__(**kwargs)
+        self.token = token
+
+    def default(self, obj):
+        if isinstance(obj, _Placeholder):
+            return self.token + str(obj.index)
+        return super(_PlaceholderEncoder, self).default(obj)
+
+
+def _array_text(array, item_separator, key_separator):
+    '''Format an array in the pif form of nested lists of Scalar objects'''
+    # Finite floats are written by the json module as their repr, and the check is much cheaper on the whole array
+    if array.dtype.kind == 'f' and np.isfinite(array).all():
+        number = float.__repr__
+    else:
+        number = json.dumps
+    start = '{"value"' + key_separator
+    separator = '}' + item_separator + start
+
+    def text(data):
+        if len(data) == 0:
+            return '[]'
+        if isinstance(data[0], list):
+            return '[' + item_separator.join([text(x) for x in data]) + ']'
+        return '[' + start + separator.join(map(number, data)) + '}]'
+    return text(array.tolist())
+
+
+def dump_pif(pif, fp, indent=None, separators=None):
+    '''Write a pif (or a list of pifs) to a binary stream as JSON
+
+    Gives the same document as `pypif.pif.dump` with the same options, but faster. The arrays of large properties,
+     such as the density of states and the forces, are written straight from their values rather than through one
+     dictionary per number. Without an indent, the output is compact.
+
+    Input:
+        pif - ChemicalSystem, or list or dictionary holding pifs, to write
+        fp - file, opened in binary mode
+        indent - int or str, indentation of nested objects. By default, everything is written on one line
+        separators - (item separator, key separator). Defaults to (',', ':') without an indent,
+            and (',', ': ') with one
+    '''
+    if separators is None:
+        separators = (',', ':') if indent is None else (',', ': ')
+
+    # Indented documents are meant to be read by people, and have their arrays converted like everything else
+    if indent is not None:
+        fp.write(json.dumps(_plain(pif, None), cls=PifEncoder, indent=indent,
+                            separators=separators).encode('ascii'))
+        return
+
+    # Encode all but the arrays with the json module, then write each array where its placeholder ended up
+    arrays = []
+    token = 'dfttopif-array-{}-'.format(uuid.uuid4().hex)
+    text = _PlaceholderEncoder(token, separators=separators).encode(_plain(pif, arrays))
+    for i, piece in enumerate(re.split('"{}([0-9]+)"'.format(token), text)):
+        if i % 2 == 1:
+            piece = _array_text(arrays[int(piece)], *separators)
+        fp.write(piece.encode('ascii'))
+
+
+def dumps_pif(pif, indent=None, separators=None):
+    '''Convert a pif (or a list of pifs) to JSON
+
+    Input:
+        see `dump_pif`
+    Returns:
+        bytes, JSON document
+    '''
+    buf = io.BytesIO()
+    dump_pif(pif, buf, indent=indent, separators=separators)
+    return buf.getvalue()
@@ -0,0 +1,113 @@
+import sys
+from timeit import default_timer
+
+
+class _Span(object):
+    '''Context manager that reports its duration to a tracer when it exits'''
+
+    def __init__(self, tracer, kind, name):
+        self.tracer = tracer
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.kind, self.name, default_timer() - self.start)
+        return False
+
+
+class _NullSpan(object):
+    '''Span that does nothing'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class Tracer(object):
+    '''Receives timed spans from a conversion
+
+    The conversion opens a span for each step, named by its kind and a name:
+        'extract', None - unpacking an archive
+        'detect', parser name - checking whether a parser recognizes the files
+        'construct', parser name - creating the parser
+        'metadata', field - chemical formula and software version
+        'setting', setting name - each setting getter
+        'property', property name - each property getter
+        'quality report', None - waiting for the quality report
+        'assembly', None - building the whole pif, including the getters
+        'serialization', destination - writing the pif out
+
+    This base class ignores every span. Subclasses override `record`, or `span` to wrap the steps differently.
+    '''
+
+    def span(self, kind, name=None):
+        '''Open a span
+
+        Input:
+            kind - str, kind of step
+            name - str, name of the step within its kind
+        Returns:
+            context manager covering the step
+        '''
+        return _null_span
+
+    def record(self, kind, name, seconds):
+        '''Receive a finished span
+
+        Input:
+            kind - str, kind of step
+            name - str, name of the step within its kind
+            seconds - float, duration of the step
+        '''
+        pass
+
+
+null_tracer = Tracer()
+
+
+class TimingCollector(Tracer):
+    '''Tracer that keeps the duration of each span and prints them as a table
+
+    Spans with the same kind and name, e.g. from converting several directories, are added together.'''
+
+    def __init__(self):
+        self.spans = []
+
+    def span(self, kind, name=None):
+        return _Span(self, kind, name)
+
+    def record(self, kind, name, seconds):
+        self.spans.append((kind, name, seconds))
+
+    def totals(self):
+        '''Get the total time spent in each kind of step
+
+        Returns:
+            [(kind, name, calls, seconds)], sorted from slowest to fastest'''
+        totals = {}
+        for kind, name, seconds in self.spans:
+            calls, total = totals.get((kind, name), (0, 0.0))
+            totals[(kind, name)] = (calls + 1, total + seconds)
+        return sorted([(k[0], k[1], v[0], v[1]) for k, v in totals.items()], key=lambda x: -x[3])
+
+    def report(self, stream=None):
+        '''Print the time spent in each step, slowest first
+
+        Input:
+            stream - file, where to print the table. Defaults to stdout
+        '''
+        if stream is None:
+            stream = sys.stdout
+        rows = self.totals()
+        stream.write('{:<15} {:<40} {:>6} {:>10}\n'.format('Kind', 'Name', 'Calls', 'Time (s)'))
+        for kind, name, calls, seconds in rows:
+            stream.write('{:<15} {:<40} {:>6} {:>10.4f}\n'.format(kind, name or '', calls, seconds))
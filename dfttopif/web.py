@@ -1,9 +1,12 @@
 import sys
+import time
 import json
 import logging
+import threading
+import itertools
 import requests
-from pypif import pif
-from flask import Flask, request
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dfttopif import *
 
@@ -15,6 +18,26 @@ CORS(app)
 # Configure logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+# Configure the asynchronous conversions. At most MAX_CONVERSIONS archives are downloaded and converted at a time, and
+#  at most MAX_PENDING_CONVERSIONS may be waiting or running before new requests are turned away
+MAX_CONVERSIONS = int(os.environ.get('DFTTOPIF_MAX_CONVERSIONS', 4))
+MAX_PENDING_CONVERSIONS = int(os.environ.get('DFTTOPIF_MAX_PENDING_CONVERSIONS', 4 * MAX_CONVERSIONS))
+DOWNLOAD_TIMEOUT = float(os.environ.get('DFTTOPIF_DOWNLOAD_TIMEOUT', 60))
+MAX_BATCH_SIZE = int(os.environ.get('DFTTOPIF_MAX_BATCH_SIZE', 1000))
+
+# Finished jobs whose result is not fetched within JOB_TTL seconds are forgotten
+JOB_TTL = float(os.environ.get('DFTTOPIF_JOB_TTL', 3600))
+
+# Optionally keep converted pifs on disk, so that re-submitted archives are not parsed again
+_cache = ConversionCache(os.environ['DFTTOPIF_CACHE_DIR'], int(os.environ.get('DFTTOPIF_CACHE_SIZE', 1024 ** 3))) \
+    if 'DFTTOPIF_CACHE_DIR' in os.environ else None
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONVERSIONS)
+_pending = threading.BoundedSemaphore(MAX_PENDING_CONVERSIONS)
+_jobs = {}
+_finished_jobs = {}
+_jobs_lock = threading.Lock()
+
 
 @app.route('/convert/from/tarfile', methods=['POST'])
 def convert_from_tarfile():
@@ -28,6 +51,166 @@ def convert_from_tarfile():
         filename = temp_dir_name + '/file_to_process'
         with open(filename, 'wb') as output:
             shutil.copyfileobj(response.raw, output)
-        return pif.dumps({'system': tarfile_to_pif(filename, '/tmp/')})
+        return dumps_pif({'system': tarfile_to_pif(filename, '/tmp/', cache=_cache)})
     finally:
         shutil.rmtree(temp_dir_name)
+
+
+def _convert_url(url):
+    """
+    Download a tar file and convert it, decoding the archive as it arrives rather than saving it first
+    :param url: location of the tar file
+    :return: the created pif
+    """
+    response = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return tarstream_to_pif(response.raw, '/tmp/')
+    finally:
+        response.close()
+
+
+def _run_slot(url):
+    """Convert a tar file for the batch endpoint, releasing its slot once done"""
+    try:
+        return _convert_url(url)
+    finally:
+        _pending.release()
+
+
+def _run_job(url, job_id):
+    """Convert a tar file for the asynchronous endpoint, releasing its slot and noting when it finished"""
+    try:
+        return _convert_url(url)
+    finally:
+        with _jobs_lock:
+            _finished_jobs[job_id] = time.time()
+        _pending.release()
+
+
+def _evict_expired_jobs():
+    """Forget the finished jobs whose result was not fetched in time. Must be called with _jobs_lock held"""
+    expiry = time.time() - JOB_TTL
+    for job_id in [k for k, v in _finished_jobs.items() if v < expiry]:
+        del _finished_jobs[job_id]
+        _jobs.pop(job_id, None)
+
+
+@app.route('/convert/from/tarfile/async', methods=['POST'])
+def convert_from_tarfile_async():
+    """
+    Queue the conversion of a tar file, returning right away with the location of the result.
+    Responds with 503 if too many conversions are already waiting, so clients can back off and retry.
+    """
+    data = json.loads(request.get_data(as_text=True))
+    if not _pending.acquire(False):
+        response = jsonify({'error': 'Too many conversions in progress'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    job_id = str(uuid.uuid4())
+    try:
+        future = _executor.submit(_run_job, data['url'], job_id)
+    except Exception:
+        _pending.release()
+        raise
+    with _jobs_lock:
+        _evict_expired_jobs()
+        _jobs[job_id] = future
+
+    response = jsonify({'id': job_id, 'status': 'pending'})
+    response.status_code = 202
+    response.headers['Location'] = '/convert/jobs/' + job_id
+    return response
+
+
+@app.route('/convert/jobs/<job_id>', methods=['GET'])
+def get_conversion_job(job_id):
+    """
+    Get the status of an asynchronous conversion. Finished jobs are forgotten once their result is returned,
+    or JOB_TTL seconds after they finished if it is never fetched.
+    """
+    with _jobs_lock:
+        _evict_expired_jobs()
+        future = _jobs.get(job_id)
+        if future is not None and future.done():
+            del _jobs[job_id]
+            _finished_jobs.pop(job_id, None)
+    if future is None:
+        response = jsonify({'error': 'Unknown job'})
+        response.status_code = 404
+        return response
+    if not future.done():
+        return jsonify({'id': job_id, 'status': 'pending'})
+    if future.exception() is not None:
+        logging.error('Conversion failed', exc_info=future.exception())
+        return jsonify({'id': job_id, 'status': 'failed', 'error': str(future.exception())})
+    return app.response_class(dumps_pif({'id': job_id, 'status': 'done', 'system': future.result()}),
+                              mimetype='application/json')
+
+
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    """
+    Convert a list of tar files, given as {"urls": [...]}, on the shared conversion pool.
+
+    The response is newline-delimited JSON, with one line per archive written as soon as it is converted:
+    {"index": <position in urls>, "url": ..., "system": <pif>} or {"index": ..., "url": ..., "error": ...}
+
+    Each archive being converted takes one of the MAX_PENDING_CONVERSIONS slots shared with the asynchronous
+    endpoint, so a batch only runs as many at once as there are free slots, and always at least one.
+    Responds with 503 if no slot is free.
+    """
+    data = json.loads(request.get_data(as_text=True))
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list):
+        response = jsonify({'error': 'Expected {"urls": [...]}'})
+        response.status_code = 400
+        return response
+    if len(urls) > MAX_BATCH_SIZE:
+        response = jsonify({'error': 'At most {} urls per batch'.format(MAX_BATCH_SIZE)})
+        response.status_code = 413
+        return response
+    if not _pending.acquire(False):
+        response = jsonify({'error': 'Too many conversions in progress'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    # The slot is taken again once the response starts streaming, so that it is not lost if it never does
+    _pending.release()
+
+    def generate():
+        remaining = iter(enumerate(urls))
+        futures = {}
+        try:
+            while True:
+                # Submit more archives while slots are free, waiting for one if nothing of this batch is running
+                for i, url in remaining:
+                    if not _pending.acquire(len(futures) == 0):
+                        remaining = itertools.chain([(i, url)], remaining)
+                        break
+                    try:
+                        futures[_executor.submit(_run_slot, url)] = i
+                    except Exception:
+                        _pending.release()
+                        raise
+                if not futures:
+                    return
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    if future.exception() is not None:
+                        line = json.dumps({'index': i, 'url': urls[i], 'error': str(future.exception())}).encode('utf-8')
+                    else:
+                        line = dumps_pif({'index': i, 'url': urls[i], 'system': future.result()})
+                    yield line + b'\n'
+        finally:
+            # Stop converting if the client goes away, freeing the slots of the archives that never started
+            for future in futures:
+                if future.cancel():
+                    _pending.release()
+
+    return Response(generate(), mimetype='application/x-ndjson')
@@ -1,8 +1,14 @@
+import os
+import re
 from setuptools import setup, find_packages
 
+# The version is kept in the package, which records it in the conversion cache and the crawl manifests
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dfttopif', '__init__.py')) as fp:
+    version = re.search(r"^__version__ = '([^']+)'", fp.read(), re.M).group(1)
+
 setup(
     name='dfttopif',
-    version='1.1.0',
+    version=version,
     description='Library for parsing Density Functional Theory calculations',
     url='https://github.com/CitrineInformatics/pif-dft',
     install_requires=[
@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from pypif import pif
+from pypif.obj import Property, Value, Scalar
+from dfttopif.parsers.arrays import ArrayProperty, ArrayValue
+
+
+class TestArrays(unittest.TestCase):
+    '''
+    Tests for the array-backed Value and Property
+    '''
+
+    def test_serialization(self):
+        forces = np.array([[0.1, -0.2, 0.3], [1.0, 2.5, -3.0]])
+        energy = np.array([-1.5, 0.0, 1.5])
+        array = ArrayProperty(vectors=forces, units='eV/Angstrom',
+                              conditions=ArrayValue(name='energy', scalars=energy, units='eV'))
+        plain = Property(vectors=[[Scalar(value=x) for x in y] for y in forces.tolist()], units='eV/Angstrom',
+                         conditions=Value(name='energy', scalars=[Scalar(value=x) for x in energy.tolist()],
+                                          units='eV'))
+        self.assertEqual(pif.dumps(plain), pif.dumps(array))
+
+        # The array is kept as is, and read as Scalars through the usual fields
+        self.assertIs(forces, array.array('vectors'))
+        self.assertIsNone(array.array('scalars'))
+        self.assertEqual(-0.2, array.vectors[0][1].value)
+        self.assertEqual(3, len(array.conditions.scalars))
+
+    def test_lists(self):
+        prop = ArrayProperty(scalars=[Scalar(value=1)])
+        self.assertEqual(1, prop.scalars[0].value)
+        self.assertIsNone(prop.array('scalars'))
+        self.assertEqual('{"scalars": [{"value": 1}]}', pif.dumps(prop))
+
+    def test_dimensions(self):
+        with self.assertRaises(ValueError):
+            ArrayProperty(vectors=np.zeros(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
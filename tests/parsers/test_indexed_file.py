@@ -0,0 +1,39 @@
+import unittest
+import os
+import shutil
+import tempfile
+from dfttopif.parsers.indexed_file import IndexedFile
+
+
+class TestIndexedFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'output')
+        with open(self.path, 'w') as fp:
+            fp.write('header\n  pressure = 1.0\nblock start\n  a b\n  pressure = 2.0\nlast line')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        with IndexedFile(self.path) as index:
+            self.assertEqual(7, index.find('pressure'))
+            self.assertEqual(42, index.last_offset('pressure'))
+            self.assertEqual(b'  pressure = 2.0\n', index.read(index.last_offset('pressure'), index.find('last')))
+            self.assertEqual(b'last line', index.read(index.find('last')))
+            self.assertIsNone(index.find('missing'))
+            self.assertIsNone(index.last_offset('missing'))
+            self.assertEqual(7, index.last_offset('pressure', index.find('block')))
+            self.assertIsNone(index.last_offset('block', index.find('block')))
+        self.assertEqual(b'', index.read())
+
+    def test_empty_file(self):
+        open(self.path, 'w').close()
+        with IndexedFile(self.path) as index:
+            self.assertIsNone(index.find('pressure'))
+            self.assertEqual(b'', index.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,6 +45,7 @@ class TestPWSCFParser(unittest.TestCase):
 
         strc = parser.get_output_structure()
         self.assertEquals(2.2713025676424632, strc.cell[0][2])
+        self.assertIs(strc, parser.get_output_structure())  # Parsed only once
         self.assertEquals(['F', 'Na'], strc.get_chemical_symbols())
         self.assertEquals('FNa', parser.get_composition())
 
@@ -345,6 +346,66 @@ class TestPWSCFParser(unittest.TestCase):
 
         # Delete the data
         delete_example('pw_lda+U')
-        
+
+    def test_steps(self):
+        """Make sure the ionic steps are read one at a time, ending with the final scf calculation"""
+        parser = self.get_parser('TiO2.vcrelax')
+        try:
+            steps = list(parser.iter_steps())
+            self.assertEqual(list(range(10)), [x['step'] for x in steps])
+            self.assertAlmostEqual(-724.67401618 * 13.605693012183622, steps[0]['energy'])
+            self.assertAlmostEqual(136.26984, steps[0]['volume'], places=4)
+            self.assertEqual([-81.34, 0, 0], list(steps[0]['stress'][0]))
+
+            # The forces are converted from Ry/bohr, and the non-local contributions that follow them are skipped
+            self.assertEqual((12, 3), steps[0]['forces'].shape)
+            self.assertAlmostEqual(-0.00415479 * 13.605693012183622 / 0.529177249, steps[0]['forces'][4][2])
+
+            # The last step is the final structure
+            final = parser.get_output_structure()
+            self.assertAlmostEqual(parser.get_total_energy().scalars[0].value * 13.605693012183622,
+                                   steps[-1]['energy'])
+            self.assertTrue(abs(final.positions - steps[-1]['positions']).max() < 1e-4)
+            self.assertAlmostEqual(final.get_volume(), steps[-1]['volume'], places=2)
+
+            self.assertEqual([0, 4, 8], [x['step'] for x in parser.iter_steps(stride=4)])
+        finally:
+            delete_example('TiO2.vcrelax')
+
+    def test_file_roles(self):
+        """Make sure each file is classified once, from its header"""
+        parser = self.get_parser('VS2.scf')
+        try:
+            roles = dict((os.path.basename(f), role) for f, role in parser.file_roles.items())
+            self.assertEqual('output', roles['pw.out'])
+            self.assertEqual('input', roles['pw.in'])
+            self.assertEqual('dos', roles['pw.dos'])
+            self.assertIsNone(roles['dos.in'])
+            self.assertEqual(os.path.join('VS2.scf', 'pw.dos'), parser.dosf)
+
+            # The DOS is read once for both the DOS and the band gap
+            dos = parser.get_dos().array('scalars').tolist()
+            os.unlink(parser.dosf)
+            self.assertEqual(dos, parser.get_dos().array('scalars').tolist())
+            self.assertIsNotNone(parser.get_band_gap())
+        finally:
+            delete_example('VS2.scf')
+
+    def test_single_output_pass(self):
+        """Make sure the output-based getters are served without re-reading the file"""
+        parser = self.get_parser('TiO2.vcrelax')
+        os.unlink(parser.outputf)
+        try:
+            self.assertEquals(3.7373367889445048, parser.get_output_structure().cell[0][0])
+            self.assertEquals(['Ti.pz-sp-van_ak.UPF', 'O.pz-van_ak.UPF'],
+                              list(map(lambda x: x.value, parser.get_pp_name().scalars)))
+            self.assertEquals(4800, parser.get_KPPRA().scalars[0].value)
+            self.assertIsNotNone(parser.is_relaxed())
+            self.assertTrue(parser.is_converged().scalars[0].value)
+            self.assertIsNone(parser.uses_SOC())
+            self.assertIsNone(parser.get_U_settings())
+        finally:
+            delete_example('TiO2.vcrelax')
+
 if __name__ == '__main__':
     unittest.main()
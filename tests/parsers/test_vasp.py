@@ -3,8 +3,13 @@ from dfttopif.parsers import VaspParser
 from dfttopif.parsers.base import InvalidIngesterException
 from ..test_pif import unpack_example, delete_example
 from pypif.obj.common.value import Value
+import io
 import os
 import shutil
+import itertools
+from ase.io.vasp import read_vasp_out
+from dfttopif import directory_to_pif
+from dfttopif.parsers.vasp import compact_outcar
 
 
 class TestVASPParser(unittest.TestCase):
@@ -60,6 +65,24 @@ class TestVASPParser(unittest.TestCase):
         self.assertEquals([0.0, 0.0, -1.19974e-35, -3.6470000000000002e-30, -1.3654e-25, -2.0122999999999998e-21, -1.1612e-17, -2.5870000000000001e-14, -2.3158e-11, -8.1289999999999995e-09, -1.1086000000000001e-06, -5.7370000000000001e-05, -0.0010558, -0.0053100000000000005, 0.0099659999999999992, 0.09085, 0.12007000000000001, 0.035970000000000002, -0.0050520000000000001, -0.002444, -0.00020777999999999999, -5.8720000000000007e-06, -6.1280000000000003e-08, -2.4453999999999996e-10, -3.7849999999999995e-13, -2.3017e-16, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, -1.0769999999999999e-36, -1.263846e-31, -4.5653699999999997e-27, -6.5055699999999999e-23, -3.6695199999999999e-19, -7.9435000000000008e-16, -7.0263000000000001e-13, -2.4759000000000002e-10, -3.4771000000000001e-08, -1.9404999999999999e-06, -4.2440999999999996e-05, -0.00034220000000000002, -0.00067650000000000002, 0.0028322, 0.017154000000000003, 0.04342, 0.058620000000000005, 0.043749999999999997, 0.025759999999999998, 0.018255, 0.020630000000000003, 0.040410000000000001, 0.070239999999999997, 0.089269999999999988, 0.10810999999999998, 0.11366000000000001, 0.066860000000000003, 0.014122000000000001, -0.0024438999999999997, -0.0013060000000000001, -0.00014683900000000001, -5.8520999999999994e-06, -2.7914999999999999e-06, -5.1669999999999998e-05, -0.00035110000000000002, -0.00036900000000000002, 0.003519, 0.012931, 0.030180000000000002, 0.080740000000000006, 0.14502999999999999, 0.14307999999999998, 0.11418, 0.10038, 0.07102, 0.02673, 0.0029481000000000004, -0.0012769000000000001, -0.00048329999999999998, -5.4889999999999998e-05, -2.3511000000000002e-06, -3.941e-08, -2.6148000000000001e-10, -6.892999999999999e-13, -7.2260000000000005e-16, -1.4030000000000001e-19, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, -2.361e-35, -1.513e-30, -3.6580000027900005e-26, -3.4550000174800002e-22, -1.24900004155e-18, -1.8020003855000002e-15, -1.0360013670000001e-12, -2.38501934e-10, -2.2271089e-08, -8.632447e-07, -1.4562029999999999e-05, -0.00011538919999999999, -0.00040824000000000004, 0.00026865999999999999, 0.0074427299999999998, 0.024236000000000001, 0.037592, 0.039448999999999998, 0.040390000000000002, 0.047368, 0.045290000000000004, 0.043109999999999996, 0.065069999999999989, 0.084000000000000005, 0.08388000000000001, 0.078009999999999996, 0.066009999999999999, 0.051519999999999996, 0.046550000000000001, 0.055629999999999999, 0.074740000000000001, 0.097983000000000001, 0.086382, 0.063489999999999991, 0.072400000000000006, 0.058990000000000001, 0.038935999999999998, 0.030331999999999998, 0.029690000000000001, 0.037170000000000002, 0.04317, 0.044810000000000003, 0.057980000000000004, 0.075889999999999999, 0.087109999999999993, 0.089520000000000002, 0.088499999999999995, 0.090439999999999993, 0.096759999999999999, 0.1026, 0.10458999999999999, 0.10609, 0.092800000000000007, 0.056925999999999997, 0.017107000000000001, 0.0022797, 0.0054678000000000001, 0.0087969099999999998, 0.0086576974000000008, 0.0093789968080000008, 0.0110199999868, 0.01219999999997858, 0.0067749999999999868, 0.0029060000000000002, 0.0047070000000000002, 0.0056299999999999996, 0.0087919999999999995, 0.01132, 0.0086099999999999996, 0.0044559999999999999, 0.0055139999999994412, 0.0090759999996227001, 0.0097889998984000016, 0.01070998865, 0.0092994370999999985, 0.0061547299999999997, 0.0065844000000000007, 0.0091786999999999997, 0.006215, 0.0083759999999999998, 0.068430000000000005, 0.21668999999999999, 0.37070000000000003, 0.47799999999999998, 0.36899999999999999, 0.13123000000000001, 0.018269000000000001, 0.011729999999999999, 0.022500600000000003, 0.02993055, 0.034198961999999999, 0.042799988399999996, 0.061819999945499998, 0.079549999999893997, 0.070929999999999924, 0.039800000000000002, 0.016230000000000001, 0.01172, 0.01259, 0.0074139999999999996, 0.00513, 0.003588, 0.00072320000000000001, -0.0001964, -6.6060000000000001e-05, -5.1070000000000004e-06, -1.346e-07, -1.308e-09, -4.815e-12, -6.7919999999999999e-15, -3.743e-18, 0.0, 0.0, 0.0, 0.0, 0.0],
                           list(map(lambda x: x.value, dos.scalars)))
    
+        # Test the arrays backing the DOS
+        doscar = parser._get_doscar_data()
+        self.assertAlmostEqual(8.47484268, doscar['efermi'])
+        self.assertEqual((301, 2), doscar['dos'].shape)
+        self.assertEqual((301, 2), doscar['integrated dos'].shape)
+        self.assertEqual(5, len(doscar['projected']))
+        self.assertEqual((301, 32), doscar['projected'][0].shape)
+        self.assertIs(doscar, parser._get_doscar_data())
+
+        # Test the band edges from the EIGENVAL
+        eigenval = parser._get_eigenval_data()
+        self.assertEqual((2, 84, 27), eigenval['energies'].shape)
+        self.assertEqual((84, 3), eigenval['kpoints'].shape)
+        edges = parser._get_band_edges(eigenval['energies'], 18)
+        self.assertEqual([6.396411, 10.203766], edges['valence band maximum'].tolist())
+        self.assertEqual([83, 83], edges['vbm kpoint'].tolist())
+        self.assertEqual([0, 0], edges['band gap'].tolist())
+
         total_mag = parser.get_total_magnetization()
         assert(total_mag.scalars[0].value == 3.9999992)
         assert(total_mag.units == "Bohr")
@@ -161,6 +184,7 @@ class TestVASPParser(unittest.TestCase):
 
         # Make sure it gets the last ionic step
         strc = parser.get_output_structure()
+        self.assertIs(strc, parser.get_output_structure())  # Parsed only once
         self.assertAlmostEquals(3.3681598291240786, strc.cell[1][0])
         self.assertEquals(['Li','Pt','Sn','Y'], strc.get_chemical_symbols())
         self.assertEquals('LiPtSnY', parser.get_composition())
@@ -268,6 +292,118 @@ class TestVASPParser(unittest.TestCase):
         # Delete the data
         delete_example('vdW')
 
+    def test_single_outcar_pass(self):
+        """Make sure the OUTCAR-based settings are served without re-reading the file"""
+        parser = self.get_parser('perov_relax_U')
+        os.unlink(os.path.join('perov_relax_U', 'OUTCAR'))
+        try:
+            self.assertEquals(400, parser.get_cutoff_energy().scalars[0].value)
+            self.assertTrue(parser.is_converged().scalars[0].value)
+            self.assertAlmostEqual(-39.85550532, parser.get_total_energy().scalars[0].value)
+            self.assertEquals(8640, parser.get_KPPRA().scalars[0].value)
+            self.assertEquals('5.3.2', parser.get_version_number())
+            self.assertEquals(2, parser.get_U_settings().as_dictionary()['Type'])
+            self.assertEquals(0.09, parser.get_pressure().scalars[0].value)
+        finally:
+            delete_example('perov_relax_U')
+
+    def test_unreadable_settings(self):
+        """Make sure a garbled line only breaks the getters that need it"""
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        try:
+            # Garble the last k-point weight listing and the NELM setting
+            path = os.path.join('perov_relax_U', 'OUTCAR')
+            with open(path) as fp:
+                lines = fp.readlines()
+            lines[406] = '  0.000000  0.000000  0.000000      ******\n'
+            lines[533] = '   NELM   =     **;   NELMIN=  5; NELMDL= -5     # of ELM steps \n'
+            with open(path, 'w') as fp:
+                fp.writelines(lines)
+
+            parser = VaspParser.generate_from_directory('perov_relax_U')
+            self.assertEquals(400, parser.get_cutoff_energy().scalars[0].value)
+            self.assertAlmostEqual(-39.85550532, parser.get_total_energy().scalars[0].value)
+            self.assertRaises(Exception, parser.get_KPPRA)
+            self.assertRaises(Exception, parser.is_converged)
+        finally:
+            delete_example('perov_relax_U')
+
+    def test_steps(self):
+        """Make sure the ionic steps are read one at a time, ending with the final state"""
+        parser = self.get_parser('perov_relax_U')
+        try:
+            steps = list(parser.iter_steps())
+            self.assertEqual([0, 1, 2], [x['step'] for x in steps])
+            self.assertEqual([-39.83302092, -39.81873190, -39.85550532], [x['energy'] for x in steps])
+            self.assertEqual((5, 3), steps[0]['positions'].shape)
+            self.assertEqual([-48.30483, 0, 0], list(steps[0]['stress'][0]))
+
+            # The last step is the final structure
+            forces = parser.get_forces()
+            self.assertEqual(forces.array('vectors').tolist(), steps[-1]['forces'].tolist())
+            self.assertEqual(forces.conditions.array('vectors').tolist(), steps[-1]['positions'].tolist())
+            self.assertAlmostEqual(parser.get_final_volume().scalars[0].value, steps[-1]['volume'], places=2)
+
+            self.assertEqual([0, 2], [x['step'] for x in parser.iter_steps(stride=2)])
+            trajectory = parser.get_trajectory(stride=2)
+            self.assertEqual([-39.83302092, -39.85550532], [x.value for x in trajectory.scalars])
+            self.assertEqual(['Ionic step', 'Positions', 'Forces', 'Stress', 'Volume'],
+                             [x.name for x in trajectory.conditions])
+            self.assertEqual((2, 5, 3), trajectory.conditions[2].array('matrices').shape)
+
+            # Strides below 1 are rejected
+            with self.assertRaises(ValueError):
+                list(parser.iter_steps(stride=0))
+
+            # Steps without positions and forces leave them out of the trajectory
+            parser.outcar = os.path.join('perov_relax_U', 'OUTCAR.noforces')
+            with open(os.path.join('perov_relax_U', 'OUTCAR')) as fi, open(parser.outcar, 'w') as fo:
+                fo.writelines(x for x in fi if 'TOTAL-FORCE' not in x)
+            trajectory = parser.get_trajectory()
+            self.assertEqual(3, len(trajectory.scalars))
+            self.assertEqual(['Ionic step', 'Stress', 'Volume'], [x.name for x in trajectory.conditions])
+
+            # Steps without a cell have no volume
+            parser.outcar = os.path.join('perov_relax_U', 'OUTCAR.nocell')
+            with open(os.path.join('perov_relax_U', 'OUTCAR')) as fi, open(parser.outcar, 'w') as fo:
+                fo.writelines(x for x in fi if 'direct lattice vectors' not in x)
+            self.assertEqual([None] * 3, [x['volume'] for x in parser.iter_steps()])
+            trajectory = parser.get_trajectory()
+            self.assertEqual(['Ionic step', 'Positions', 'Forces', 'Stress'], [x.name for x in trajectory.conditions])
+        finally:
+            delete_example('perov_relax_U')
+
+    def test_interrupted_run(self):
+        """Make sure a relaxation stopped in the middle of an ionic step gives its last complete step"""
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        try:
+            os.mkdir('interrupted')
+            with open(os.path.join('perov_relax_U', 'OUTCAR')) as fi, \
+                    open(os.path.join('interrupted', 'OUTCAR'), 'w') as fo:
+                fo.writelines(itertools.islice(fi, 14300))
+            for name in ['INCAR', 'POSCAR']:
+                shutil.copy(os.path.join('perov_relax_U', name), 'interrupted')
+
+            result = directory_to_pif('interrupted', quality_report=False)
+            self.assertEqual('LaMnO3', result.chemical_formula)
+
+            # The compacted OUTCAR gives the structure of the second step, as the full one does
+            full = read_vasp_out(os.path.join('interrupted', 'OUTCAR'))
+            compact = read_vasp_out(io.StringIO(compact_outcar(os.path.join('interrupted', 'OUTCAR')).decode('utf-8')))
+            self.assertEqual(full.positions.tolist(), compact.positions.tolist())
+            self.assertEqual(full.get_forces().tolist(), compact.get_forces().tolist())
+            self.assertEqual(full.get_potential_energy(), compact.get_potential_energy())
+
+            # Without a complete step, the OUTCAR is kept whole
+            with open(os.path.join('perov_relax_U', 'OUTCAR')) as fi, \
+                    open(os.path.join('interrupted', 'OUTCAR'), 'w') as fo:
+                fo.writelines(itertools.islice(fi, 7000))
+            with open(os.path.join('interrupted', 'OUTCAR'), 'rb') as fp:
+                self.assertEqual(fp.read(), compact_outcar(os.path.join('interrupted', 'OUTCAR')))
+        finally:
+            shutil.rmtree('interrupted', ignore_errors=True)
+            delete_example('perov_relax_U')
+
     def test_filename_robustness(self):
         """Make sure that parser can handle OUTCARs having other extensions"""
 
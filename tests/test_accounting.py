@@ -0,0 +1,84 @@
+import unittest
+import glob
+import io
+import os
+import shutil
+import tempfile
+import tarfile
+from dfttopif import directory_to_pif, detect_parser, IOAccounting
+from dfttopif.parsers.base import header_size
+
+
+class TestIOAccounting(unittest.TestCase):
+    '''
+    Tests for counting file reads, and limits on how often each example reads its files
+    '''
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _unpack(self, archive):
+        tarfile.open(archive).extractall(self.temp_dir)
+        return os.path.join(self.temp_dir, os.listdir(self.temp_dir)[0])
+
+    def _convert(self, archive):
+        directory = self._unpack(archive)
+        with IOAccounting() as accounting:
+            directory_to_pif(directory, quality_report=False)
+        parser = detect_parser([os.path.join(directory, f) for f in os.listdir(directory)
+                                if os.path.isfile(os.path.join(directory, f))])
+        return accounting, parser
+
+    def test_counting(self):
+        path = os.path.join(self.temp_dir, 'file')
+        with open(path, 'w') as fp:
+            fp.write('a\nb\nc\n')
+
+        with IOAccounting() as accounting:
+            with open(path) as fp:
+                fp.readline()
+            with open(path) as fp:
+                for line in fp:
+                    pass
+            with io.open(path, 'rb') as fp:
+                fp.read()
+            with open(path, 'a') as fp:
+                fp.write('d\n')
+        self.assertEqual(3, accounting.stats(path).opens)
+        self.assertEqual(2 + 6 + 6, accounting.stats(path).bytes_read)
+        self.assertEqual(2, accounting.stats(path).passes)
+        self.assertEqual(0, accounting.stats(os.path.join(self.temp_dir, 'other')).opens)
+
+    def test_vasp_budget(self):
+        for archive in glob.glob(os.path.join('examples', 'vasp', '*.tar.gz')):
+            accounting, parser = self._convert(archive)
+            self.assertLessEqual(accounting.stats(parser.outcar).passes, 1, archive)
+            self.assertLessEqual(accounting.stats(parser.outcar).opens, 3, archive)
+            for path, stats in accounting.files.items():
+                self.assertLessEqual(stats.passes, 1, path)
+            shutil.rmtree(os.path.dirname(parser.outcar))
+
+    def test_pwscf_budget(self):
+        for archive in glob.glob(os.path.join('examples', 'pwscf', '*.tar.gz')):
+            if 'FeO' in archive:
+                # Not supported by the parser yet
+                continue
+            accounting, parser = self._convert(archive)
+            self.assertLessEqual(accounting.stats(parser.outputf).passes, 1, archive)
+            self.assertLessEqual(accounting.stats(parser.outputf).opens, 3, archive)
+            for path, stats in accounting.files.items():
+                if path == parser.inputf:
+                    self.assertLessEqual(stats.passes, 4, path)
+                else:
+                    self.assertLessEqual(stats.passes, 1, path)
+                if parser.file_roles.get(path) is None:
+                    # Files the parser does not use are only read up to their headers
+                    self.assertLessEqual(stats.bytes_read, 2 * header_size, path)
+            shutil.rmtree(os.path.dirname(parser.outputf))
+
+
+if __name__ == '__main__':
+    unittest.main()
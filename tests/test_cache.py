@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from pypif.obj import ChemicalSystem
+from dfttopif import ConversionCache, directory_to_pif, tarfile_to_pif
+from dfttopif.drivers import _conversion_options
+from .test_pif import unpack_example, delete_example
+
+
+class TestConversionCache(unittest.TestCase):
+    '''
+    Tests for the on-disk cache of converted pifs
+    '''
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_directory(self):
+        cache = ConversionCache(self.cache_dir)
+        unpack_example(os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz'))
+        try:
+            first = directory_to_pif('NaF.scf', cache=cache)
+            self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+            # Convert again, from the cache
+            second = directory_to_pif('NaF.scf', cache=cache)
+            self.assertEqual(1, len(os.listdir(self.cache_dir)))
+            self.assertEqual(first.chemical_formula, second.chemical_formula)
+            self.assertEqual([x.name for x in first.properties], [x.name for x in second.properties])
+
+            # Extracting other properties is a different conversion
+            third = directory_to_pif('NaF.scf', cache=cache, include=['Total Energy'])
+            self.assertEqual(2, len(os.listdir(self.cache_dir)))
+            self.assertEqual(['Total Energy'], [x.name for x in third.properties])
+
+            # Changing a file changes the key
+            key = cache.key([os.path.join('NaF.scf', 'aiida.in')])
+            with open(os.path.join('NaF.scf', 'aiida.in'), 'a') as fp:
+                fp.write('\n')
+            self.assertNotEqual(key, cache.key([os.path.join('NaF.scf', 'aiida.in')]))
+        finally:
+            delete_example('NaF.scf')
+
+    def test_tarfile(self):
+        cache = ConversionCache(self.cache_dir)
+        path = os.path.join('examples', 'pwscf', 'Au.nscf.tar.gz')
+        key = cache.key([path], **_conversion_options())
+        self.assertIsNone(cache.get(key))
+        first = tarfile_to_pif(path, cache=cache)
+        self.assertEqual(first.chemical_formula, cache.get(key).chemical_formula)
+        self.assertEqual(first.chemical_formula, tarfile_to_pif(path, cache=cache).chemical_formula)
+
+        # The same conversion gets the same key, however its options are spelled
+        tarfile_to_pif(path, cache=cache, include=['Total Energy', 'Converged'])
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        tarfile_to_pif(path, cache=cache, include=['Converged', 'Total Energy'], quality_report=True,
+                       trajectory=None, threads=2)
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_eviction(self):
+        cache = ConversionCache(self.cache_dir, max_size=0)
+        cache.put('a', ChemicalSystem(chemical_formula='NaCl'))
+        self.assertIsNone(cache.get('a'))
+
+        cache.max_size = 10 ** 6
+        for key in ['a', 'b', 'c']:
+            cache.put(key, ChemicalSystem(chemical_formula='NaCl'))
+            os.utime(os.path.join(self.cache_dir, key + '.json'), (time.time() - 100, time.time() - 100))
+        self.assertIsNotNone(cache.get('a'))  # Now the most recently used
+
+        cache.max_size = 2 * os.path.getsize(os.path.join(self.cache_dir, 'a.json'))
+        cache.evict()
+        self.assertEqual(['a.json', 'c.json'], sorted(os.listdir(self.cache_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+from pypif import pif
+from dfttopif import crawl, IOAccounting
+from dfttopif.crawler import Manifest, manifest_name
+
+
+class TestCrawler(unittest.TestCase):
+    '''
+    Tests for converting the new and changed calculations of a directory tree
+    '''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path, destination in [(os.path.join('examples', 'vasp', 'AlNi_static_LDA.tar.gz'), 'project'),
+                                  (os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz'), os.path.join('project', 'qe'))]:
+            with tarfile.open(path) as tp:
+                tp.extractall(os.path.join(self.root, destination))
+        os.makedirs(os.path.join(self.root, 'notes'))
+        with open(os.path.join(self.root, 'notes', 'README'), 'w') as fp:
+            fp.write('Not a calculation\n')
+        self.vasp = os.path.join(self.root, 'project', 'AlNi_static_LDA')
+        self.pwscf = os.path.join(self.root, 'project', 'qe', 'NaF.scf')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def crawl(self):
+        return dict((path, status) for path, status, error in crawl(self.root, workers=1, quality_report=False))
+
+    def test_sweeps(self):
+        self.assertEqual({self.vasp: 'converted', self.pwscf: 'converted'}, self.crawl())
+        with open(os.path.join(self.vasp, 'pif.json')) as fp:
+            self.assertEqual('AlNi', pif.load(fp).chemical_formula)
+
+        # No file of a calculation is read again when nothing changed
+        with IOAccounting() as accounting:
+            self.assertEqual({self.vasp: 'unchanged', self.pwscf: 'unchanged'}, self.crawl())
+        self.assertEqual(sorted([os.path.join(self.root, manifest_name), os.path.join(self.root, 'notes', 'README')]),
+                         sorted(accounting.files))
+
+        # Touching a file without changing it only updates the manifest
+        outcar = os.path.join(self.vasp, 'OUTCAR')
+        os.utime(outcar, (0, 0))
+        self.assertEqual({self.vasp: 'unchanged', self.pwscf: 'unchanged'}, self.crawl())
+        self.assertEqual(0, Manifest(os.path.join(self.root, manifest_name)).get(
+            os.path.join('project', 'AlNi_static_LDA'))['files']['OUTCAR'][1])
+
+        # Changed, missing and removed calculations
+        with open(os.path.join(self.pwscf, 'extra.txt'), 'w') as fp:
+            fp.write('new file\n')
+        os.remove(os.path.join(self.vasp, 'pif.json'))
+        self.assertEqual({self.vasp: 'converted', self.pwscf: 'converted'}, self.crawl())
+        shutil.rmtree(self.pwscf)
+        self.assertEqual({self.vasp: 'unchanged', self.pwscf: 'removed'}, self.crawl())
+        manifest = Manifest(os.path.join(self.root, manifest_name))
+        self.assertIsNone(manifest.get(os.path.join('project', 'qe', 'NaF.scf')))
+
+    def test_resume(self):
+        # Stop after the first conversion, as if the sweep was interrupted
+        for path, status, error in crawl(self.root, workers=1, quality_report=False):
+            self.assertEqual('converted', status)
+            first = path
+            break
+        with open(os.path.join(self.root, manifest_name), 'a') as fp:
+            fp.write('{"directory": "project/qe/Na')
+
+        # The next sweep only converts the remaining calculation
+        results = self.crawl()
+        self.assertEqual('unchanged', results[first])
+        self.assertEqual(['converted'], [x for p, x in results.items() if p != first])
+
+        # Entries appended after a torn line are kept, even if that sweep is interrupted too
+        with open(os.path.join(self.root, manifest_name), 'a') as fp:
+            fp.write('{"directory": "project/qe/Na')
+        Manifest(os.path.join(self.root, manifest_name)).record('other', {}, '{}')
+        manifest = Manifest(os.path.join(self.root, manifest_name))
+        self.assertIn('other', manifest.entries)
+        manifest.forget('other')
+
+        # Changing the options converts everything again
+        statuses = [status for path, status, error in crawl(self.root, workers=1, quality_report=False,
+                                                            include=['Total Energy'])]
+        self.assertEqual(['converted', 'converted'], statuses)
+
+
+if __name__ == '__main__':
+    unittest.main()
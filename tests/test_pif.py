@@ -1,10 +1,15 @@
 import unittest
-from dfttopif import convert
+from dfttopif import convert, detect_parser, batch_to_pif, tarfile_to_pif, IOAccounting
+from dfttopif.drivers import _extract_wanted_members
+from dfttopif.parsers import VaspParser, PwscfParser
+from dfttopif.parsers.base import header_size
+from pypif import pif
 from pypif_sdk.accessor import get_propety_by_name
 import tarfile
 import os
 import shutil
 import glob
+import tempfile
 
 
 def delete_example(name):
@@ -110,6 +115,134 @@ class TestPifGenerator(unittest.TestCase):
             
             # Delete files
             delete_example(name)
-        
+
+    def test_detection(self):
+        '''
+        Test that the parsers only claim their own directories
+        '''
+
+        unpack_example(os.path.join('examples', 'vasp', 'AlNi_static_LDA.tar.gz'))
+        unpack_example(os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz'))
+        try:
+            vasp_files = list(filter(os.path.isfile, glob.glob(os.path.join('AlNi_static_LDA', '*'))))
+            pwscf_files = list(filter(os.path.isfile, glob.glob(os.path.join('NaF.scf', '*'))))
+            self.assertTrue(VaspParser.sniff(vasp_files))
+            self.assertFalse(PwscfParser.sniff(vasp_files))
+            self.assertTrue(PwscfParser.sniff(pwscf_files))
+            self.assertFalse(VaspParser.sniff(pwscf_files))
+
+            self.assertIsInstance(detect_parser(vasp_files), VaspParser)
+            self.assertIsInstance(detect_parser(pwscf_files), PwscfParser)
+            # When both codes left output in the same directory, PWSCF takes precedence
+            self.assertIsInstance(detect_parser(vasp_files + pwscf_files), PwscfParser)
+            with self.assertRaises(Exception):
+                detect_parser([os.path.join('NaF.scf', 'aiida.in')])
+        finally:
+            delete_example('AlNi_static_LDA')
+            delete_example('NaF.scf')
+
+    def test_selected_properties(self):
+        '''
+        Test that only the requested settings and properties are extracted
+        '''
+
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        try:
+            with IOAccounting() as accounting:
+                result = convert(['perov_relax_U'], quality_report=False,
+                                 include=['Total Energy', 'Converged', 'Band Gap Energy', 'Cutoff Energy'])
+            self.assertEqual('LaMnO3', result.chemical_formula)
+            self.assertEqual(['Converged', 'Total Energy', 'Band Gap Energy'], [x.name for x in result.properties])
+            self.assertEqual(['Cutoff Energy'], [x.name for x in result.properties[0].conditions])
+
+            # The DOSCAR is only needed for the DOS, and the band gap comes from the EIGENVAL, so at most its
+            #  header is read while detecting the parser
+            doscar = accounting.stats(os.path.join('perov_relax_U', 'DOSCAR'))
+            self.assertLessEqual(doscar.bytes_read, header_size)
+            self.assertEqual(0, doscar.passes)
+
+            result = convert(['perov_relax_U'], quality_report=False, exclude=['Density of States', 'Forces'])
+            names = [x.name for x in result.properties]
+            self.assertIn('Total Energy', names)
+            self.assertNotIn('Density of States', names)
+            self.assertNotIn('Forces', names)
+        finally:
+            delete_example('perov_relax_U')
+
+    def test_threads(self):
+        '''
+        Test that calling the getters on a pool of threads gives the same pif
+        '''
+
+        examples = [os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'),
+                    os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz')]
+        for path in examples:
+            serial = tarfile_to_pif(path, quality_report=False)
+            threaded = tarfile_to_pif(path, quality_report=False, threads=4)
+            self.assertEqual([x.name for x in serial.properties], [x.name for x in threaded.properties])
+            self.assertEqual(pif.dumps(serial), pif.dumps(threaded))
+
+    def test_trajectory(self):
+        '''
+        Test that the ionic steps are only listed when requested
+        '''
+
+        path = os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz')
+        self.assertNotIn('Trajectory', [x.name for x in tarfile_to_pif(path, quality_report=False).properties])
+
+        result = tarfile_to_pif(path, quality_report=False, trajectory=1)
+        trajectory = get_propety_by_name(result, 'Trajectory')
+        self.assertEqual(3, len(trajectory.scalars))
+        self.assertEqual('eV', trajectory.units)
+        self.assertIn('Cutoff Energy', [x.name for x in trajectory.conditions])
+
+        result = tarfile_to_pif(path, quality_report=False, trajectory=1, exclude=['Trajectory'])
+        self.assertNotIn('Trajectory', [x.name for x in result.properties])
+
+    def test_batch(self):
+        '''
+        Test converting several calculations over a process pool
+        '''
+
+        names = ['AlNi_static_LDA', 'heusler_static_SOC']
+        for name in names:
+            unpack_example(os.path.join('examples', 'vasp', name + '.tar.gz'))
+        paths = names + ['not_a_calculation', os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz')]
+        try:
+            results = list(batch_to_pif(paths, workers=2, quality_report=False))
+            self.assertEqual(paths, [x[0] for x in results])
+            self.assertEqual(['AlNi', 'LiPtSnY'], [x[1].chemical_formula for x in results[:2]])
+            self.assertEqual('FNa', results[3][1].chemical_formula)
+            self.assertIsNone(results[1][2])
+            self.assertIsNone(results[2][1])
+            self.assertIsNotNone(results[2][2])
+
+            results = list(batch_to_pif(names, workers=2, ordered=False, quality_report=False))
+            self.assertEqual(sorted(names), sorted(x[0] for x in results))
+        finally:
+            for name in names:
+                delete_example(name)
+
+    def test_selective_tarfile(self):
+        '''
+        Test converting archives while only extracting the files the parsers need
+        '''
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with tarfile.open(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'), 'r|*') as tar:
+                _extract_wanted_members(tar, temp_dir)
+            self.assertEqual(['DOSCAR', 'EIGENVAL', 'INCAR', 'OUTCAR', 'POSCAR'],
+                             sorted(os.listdir(os.path.join(temp_dir, 'perov_relax_U'))))
+        finally:
+            shutil.rmtree(temp_dir)
+
+        for path in [os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'),
+                     os.path.join('examples', 'pwscf', 'VS2.scf.tar.gz')]:
+            full = tarfile_to_pif(path, quality_report=False)
+            selective = tarfile_to_pif(path, selective=True, quality_report=False)
+            self.assertEqual(full.chemical_formula, selective.chemical_formula)
+            self.assertEqual([x.name for x in full.properties], [x.name for x in selective.properties])
+
 if __name__ == '__main__':
     unittest.main()
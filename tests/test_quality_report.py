@@ -0,0 +1,177 @@
+import unittest
+import io
+import json
+import os
+import tarfile
+import shutil
+import tempfile
+import threading
+from pypif import pif
+from pypif.obj import ChemicalSystem
+from dfttopif import drivers, directory_to_pif
+from dfttopif.parsers import VaspParser
+from dfttopif.parsers.vasp import compact_outcar
+from .test_pif import unpack_example, delete_example
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class _StubValidator(BaseHTTPRequestHandler):
+    '''Stand-in for the quality report service, recording the uploaded tar files'''
+
+    uploads = []
+    status = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.uploads.append((self.path, body))
+        if self.path.endswith('/json/tarfile'):
+            report = json.dumps({'score': 7})
+        else:
+            report = 'Quality score: 7\nAll checks passed\n'
+        payload = json.dumps([report]).encode('utf-8')
+        self.send_response(self.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestQualityReport(unittest.TestCase):
+    '''
+    Tests for submitting VASP calculations to the quality report service, using a local stub server
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), _StubValidator)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.old_url = drivers.quality_report_url
+        drivers.quality_report_url = 'http://127.0.0.1:{}/validate'.format(cls.server.server_port)
+        unpack_example(os.path.join('examples', 'vasp', 'AlNi_static_LDA.tar.gz'))
+
+    @classmethod
+    def tearDownClass(cls):
+        drivers.quality_report_url = cls.old_url
+        cls.server.shutdown()
+        cls.server.server_close()
+        delete_example('AlNi_static_LDA')
+
+    def setUp(self):
+        del _StubValidator.uploads[:]
+        _StubValidator.status = 200
+
+    def test_inline(self):
+        result = directory_to_pif('AlNi_static_LDA', quality_report=True)
+        self.assertEqual({'score': 7}, result.quality_report)
+
+        # The tar file is built in memory, not in the working directory
+        self.assertFalse(os.path.exists('tmp.tar'))
+        self.assertEqual(1, len(_StubValidator.uploads))
+        path, body = _StubValidator.uploads[0]
+        self.assertEqual('/validate/json/tarfile', path)
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            self.assertEqual(['OUTCAR', 'INCAR'], tar.getnames())
+
+    def test_file(self):
+        parser = VaspParser([os.path.join('AlNi_static_LDA', f) for f in os.listdir('AlNi_static_LDA')])
+        chem = ChemicalSystem(properties=[])
+        try:
+            drivers._add_quality_report(parser, chem, inline=False)
+            self.assertEqual('/validate/tarfile', _StubValidator.uploads[0][0])
+            self.assertEqual('quality_report', chem.properties[0].name)
+            self.assertEqual(7, chem.properties[0].scalars[0].value)
+        finally:
+            os.remove(os.path.join('AlNi_static_LDA', 'quality_report.txt'))
+
+    def test_concurrent(self):
+        parser = VaspParser([os.path.join('AlNi_static_LDA', f) for f in os.listdir('AlNi_static_LDA')])
+        pending = [drivers._submit_quality_report(parser) for i in range(8)]
+        for p in pending:
+            report, score = p.get()
+            self.assertEqual(7, score)
+        self.assertEqual(8, len(_StubValidator.uploads))
+
+    def test_shared_state(self):
+        # Threads that submit their first report at the same time share one session and pool
+        saved = dict(drivers._quality_report_state)
+        drivers._quality_report_state.clear()
+        try:
+            sessions = []
+            threads = [threading.Thread(target=lambda: sessions.append(drivers._get_quality_report_state()['session']))
+                       for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(1, len(set(map(id, sessions))))
+        finally:
+            drivers._quality_report_state['pool'].terminate()
+            drivers._quality_report_state.clear()
+            drivers._quality_report_state.update(saved)
+
+    def test_interrupted_outcar(self):
+        # The reduced OUTCAR of a run stopped in the middle of an ionic step still ends with a complete step
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        try:
+            with open(os.path.join('perov_relax_U', 'OUTCAR')) as fp:
+                lines = fp.readlines()[:14300]
+            with open(os.path.join('perov_relax_U', 'OUTCAR'), 'w') as fp:
+                fp.writelines(lines)
+            parser = VaspParser([os.path.join('perov_relax_U', f) for f in os.listdir('perov_relax_U')])
+            tar = tarfile.open(fileobj=io.BytesIO(drivers._make_quality_report_tar(parser)))
+            outcar = tar.extractfile('OUTCAR').read().decode('utf-8')
+            self.assertIn('TOTAL-FORCE', outcar)
+            self.assertIn('-39.81873190', outcar)
+        finally:
+            delete_example('perov_relax_U')
+
+    def test_compact_outcar(self):
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            full = VaspParser([os.path.join('perov_relax_U', f) for f in os.listdir('perov_relax_U')])
+            with open(os.path.join(temp_dir, 'OUTCAR'), 'wb') as fp:
+                fp.write(compact_outcar(full.outcar))
+            self.assertLess(os.path.getsize(os.path.join(temp_dir, 'OUTCAR')), os.path.getsize(full.outcar) / 2)
+
+            # The reduced OUTCAR still holds the settings and the final results
+            compact = VaspParser([os.path.join(temp_dir, 'OUTCAR')])
+            self.assertEqual(full.get_cutoff_energy().scalars[0].value, compact.get_cutoff_energy().scalars[0].value)
+            self.assertEqual(pif.dumps(full.get_U_settings()), pif.dumps(compact.get_U_settings()))
+            self.assertEqual(full.get_total_energy().scalars[0].value, compact.get_total_energy().scalars[0].value)
+            self.assertEqual(full.get_pressure().scalars[0].value, compact.get_pressure().scalars[0].value)
+            self.assertEqual(pif.dumps(full.get_stresses()), pif.dumps(compact.get_stresses()))
+            self.assertEqual(full.is_converged().scalars[0].value, compact.is_converged().scalars[0].value)
+        finally:
+            shutil.rmtree(temp_dir)
+            delete_example('perov_relax_U')
+
+    def test_full_outcar(self):
+        parser = VaspParser([os.path.join('AlNi_static_LDA', f) for f in os.listdir('AlNi_static_LDA')])
+        drivers.quality_report_compact_outcar = False
+        try:
+            drivers._add_quality_report(parser, ChemicalSystem())
+        finally:
+            drivers.quality_report_compact_outcar = True
+        with tarfile.open(fileobj=io.BytesIO(_StubValidator.uploads[0][1])) as tar:
+            with open(parser.outcar, 'rb') as fp:
+                self.assertEqual(fp.read(), tar.extractfile('OUTCAR').read())
+
+    def test_failure(self):
+        _StubValidator.status = 500
+        result = directory_to_pif('AlNi_static_LDA', quality_report=True)
+        self.assertFalse(hasattr(result, 'quality_report'))
+        self.assertIsNotNone(result.properties)
+
+
+if __name__ == '__main__':
+    unittest.main()
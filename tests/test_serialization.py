@@ -0,0 +1,47 @@
+import unittest
+import io
+import os
+import numpy as np
+from pypif import pif
+from pypif.obj import ChemicalSystem
+from dfttopif import tarfile_to_pif, dump_pif, dumps_pif
+from dfttopif.parsers.arrays import ArrayProperty, ArrayValue
+
+
+class TestSerialization(unittest.TestCase):
+    '''
+    Tests for writing pifs with dfttopif's serializer
+    '''
+
+    def test_examples(self):
+        for path in [os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'),
+                     os.path.join('examples', 'pwscf', 'Au.nscf.tar.gz')]:
+            result = tarfile_to_pif(path, quality_report=False)
+
+            # Compact by default, and otherwise the same as pypif with the same options
+            self.assertEqual(pif.dumps(result, separators=(',', ':')).encode('ascii'), dumps_pif(result))
+            self.assertEqual(pif.dumps(result, indent=4).encode('ascii'), dumps_pif(result, indent=4))
+            self.assertEqual(pif.dumps([result, result]).encode('ascii'),
+                             dumps_pif([result, result], separators=(', ', ': ')))
+
+            # pypif reads it back
+            self.assertEqual(pif.dumps(pif.loads(pif.dumps(result))),
+                             pif.dumps(pif.loads(dumps_pif(result).decode('ascii'))))
+
+    def test_arrays(self):
+        chem = ChemicalSystem(chemical_formula='NaCl', properties=[
+            ArrayProperty(name='Density of States', scalars=np.array([0.0, 1.5, np.nan]),
+                          conditions=ArrayValue(name='energy', scalars=np.array([-1.0, 0.0, 1e-05]))),
+            ArrayProperty(name='Forces', vectors=np.array([[1, 2, 3], [4, 5, 6]])),
+            ArrayProperty(name='Empty', scalars=np.zeros(0)),
+        ])
+        chem.quality_report = {'score': 7, 'checks': ['cutoff']}
+        self.assertEqual(pif.dumps(chem, separators=(',', ':')).encode('ascii'), dumps_pif(chem))
+
+        fp = io.BytesIO()
+        dump_pif(chem, fp)
+        self.assertEqual(dumps_pif(chem), fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
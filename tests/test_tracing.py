@@ -0,0 +1,58 @@
+import unittest
+import os
+import shutil
+import tempfile
+from io import StringIO
+from dfttopif import directory_to_pif, tarfile_to_pif, ConversionCache, TimingCollector
+from dfttopif.parsers import VaspParser
+from .test_pif import unpack_example, delete_example
+
+
+class TestTracing(unittest.TestCase):
+    '''
+    Tests for the timing of the conversion steps
+    '''
+
+    def test_spans(self):
+        unpack_example(os.path.join('examples', 'vasp', 'perov_relax_U.tar.gz'))
+        try:
+            tracer = TimingCollector()
+            directory_to_pif('perov_relax_U', quality_report=False, tracer=tracer)
+            parser = VaspParser([os.path.join('perov_relax_U', f) for f in os.listdir('perov_relax_U')])
+        finally:
+            delete_example('perov_relax_U')
+
+        spans = set((kind, name) for kind, name, seconds in tracer.spans)
+        self.assertIn(('detect', 'VaspParser'), spans)
+        self.assertIn(('construct', 'VaspParser'), spans)
+        self.assertIn(('assembly', None), spans)
+        for name in parser.get_setting_functions().keys():
+            self.assertIn(('setting', name), spans)
+        for name in parser.get_result_functions().keys():
+            self.assertIn(('property', name), spans)
+
+        # The table lists the slowest steps first
+        totals = tracer.totals()
+        self.assertEqual(sorted([x[3] for x in totals], reverse=True), [x[3] for x in totals])
+        output = StringIO()
+        tracer.report(output)
+        self.assertIn('Total Energy', output.getvalue())
+
+    def test_cache_key(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = ConversionCache(cache_dir)
+            path = os.path.join('examples', 'pwscf', 'NaF.scf.tar.gz')
+            tarfile_to_pif(path, quality_report=False, cache=cache)
+
+            # The tracer does not change the output, so the cached pif is used
+            tracer = TimingCollector()
+            tarfile_to_pif(path, quality_report=False, cache=cache, tracer=tracer)
+            self.assertEqual([], tracer.spans)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
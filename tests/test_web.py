@@ -0,0 +1,142 @@
+import unittest
+import json
+import os
+import sys
+import threading
+import time
+
+if sys.version_info >= (3,):
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from dfttopif import web
+
+    class _ExampleServer(SimpleHTTPRequestHandler):
+        '''Serves the files under examples/'''
+
+        def translate_path(self, path):
+            path = SimpleHTTPRequestHandler.translate_path(self, path)
+            return os.path.join(os.path.abspath('examples'), os.path.relpath(path, os.getcwd()))
+
+        def log_message(self, *args):
+            pass
+
+
+@unittest.skipIf(sys.version_info < (3,), 'The web service runs on Python 3')
+class TestWebService(unittest.TestCase):
+    '''
+    Tests for the conversion web service, fetching the examples from a local HTTP server
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), _ExampleServer)
+        cls.url = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.client = web.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _wait_for(self, location):
+        for i in range(600):
+            result = json.loads(self.client.get(location).get_data(as_text=True))
+            if result['status'] != 'pending':
+                return result
+            time.sleep(0.1)
+        self.fail('Conversion did not finish')
+
+    def test_async_conversion(self):
+        response = self.client.post('/convert/from/tarfile/async',
+                                    data=json.dumps({'url': self.url + 'pwscf/NaF.scf.tar.gz'}))
+        self.assertEqual(202, response.status_code)
+        result = self._wait_for(response.headers['Location'])
+        self.assertEqual('done', result['status'])
+        self.assertEqual('FNa', result['system']['chemicalFormula'])
+
+        # Results are only handed out once
+        self.assertEqual(404, self.client.get(response.headers['Location']).status_code)
+
+        # Failures are reported through the job
+        response = self.client.post('/convert/from/tarfile/async',
+                                    data=json.dumps({'url': self.url + 'missing.tar.gz'}))
+        result = self._wait_for(response.headers['Location'])
+        self.assertEqual('failed', result['status'])
+
+    def test_job_expiry(self):
+        response = self.client.post('/convert/from/tarfile/async',
+                                    data=json.dumps({'url': self.url + 'missing.tar.gz'}))
+        job_id = response.headers['Location'].split('/')[-1]
+        for i in range(600):
+            with web._jobs_lock:
+                if job_id in web._finished_jobs:
+                    break
+            time.sleep(0.1)
+
+        # Results that are never fetched are dropped once they expire
+        ttl = web.JOB_TTL
+        web.JOB_TTL = 0
+        try:
+            self.assertEqual(404, self.client.get(response.headers['Location']).status_code)
+            self.assertNotIn(job_id, web._jobs)
+            self.assertNotIn(job_id, web._finished_jobs)
+        finally:
+            web.JOB_TTL = ttl
+
+    def test_batch(self):
+        urls = [self.url + 'pwscf/NaF.scf.tar.gz', self.url + 'missing.tar.gz', self.url + 'pwscf/Au.nscf.tar.gz']
+        response = self.client.post('/convert/batch', data=json.dumps({'urls': urls}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response.mimetype)
+
+        lines = [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([0, 1, 2], sorted(x['index'] for x in lines))
+        results = dict((x['index'], x) for x in lines)
+        self.assertEqual('FNa', results[0]['system']['chemicalFormula'])
+        self.assertIn('error', results[1])
+        self.assertEqual('Au', results[2]['system']['chemicalFormula'])
+
+    def test_batch_window(self):
+        # With a single free slot, the archives of a batch are converted one at a time
+        taken = 0
+        while web._pending.acquire(False):
+            taken += 1
+        web._pending.release()
+        taken -= 1
+        try:
+            urls = [self.url + 'pwscf/Au.nscf.tar.gz', self.url + 'missing.tar.gz', self.url + 'pwscf/Au.nscf.tar.gz']
+            response = self.client.post('/convert/batch', data=json.dumps({'urls': urls}))
+            lines = [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+            self.assertEqual([0, 1, 2], [x['index'] for x in lines])
+
+            # The slot is given back once the batch is done
+            self.assertTrue(web._pending.acquire(False))
+            taken += 1
+        finally:
+            for i in range(taken):
+                web._pending.release()
+
+    def test_batch_request(self):
+        for data in [{}, {'urls': 'a.tar.gz'}, []]:
+            response = self.client.post('/convert/batch', data=json.dumps(data))
+            self.assertEqual(400, response.status_code)
+
+    def test_backpressure(self):
+        # Take every slot, so that the next request is turned away
+        taken = 0
+        while web._pending.acquire(False):
+            taken += 1
+        try:
+            response = self.client.post('/convert/from/tarfile/async',
+                                        data=json.dumps({'url': self.url + 'pwscf/NaF.scf.tar.gz'}))
+            self.assertEqual(503, response.status_code)
+            self.assertIn('Retry-After', response.headers)
+            response = self.client.post('/convert/batch', data=json.dumps({'urls': [self.url + 'missing.tar.gz']}))
+            self.assertEqual(503, response.status_code)
+        finally:
+            for i in range(taken):
+                web._pending.release()
+
+
+if __name__ == '__main__':
+    unittest.main()